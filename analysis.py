@@ -23,21 +23,31 @@ def summary(t, S, I, R, D, save_plot, title, parameters):
 
 
 def count_total_infected(I):
-    """Counts total number of infected cases by summing all positive changes in I at each time step."""
-    changes = I[1:] - I[:-1]
-    infected = np.sum(changes[changes > 0])
-    return infected + I[0]  # add initial infected
+    """Counts total number of infected cases by summing all positive changes in I at each time step.
+
+    I can hold one run, or stacked runs with time along the last axis, in which case the total of each run is returned.
+    """
+    I = np.asarray(I)
+    changes = np.diff(I, axis=-1)
+    infected = np.sum(changes, axis=-1, where=changes > 0)
+    return infected + I[..., 0]  # add initial infected
 
 
 def count_total_deaths(D):
-    """Returns total number of deaths."""
-    return D[-1]
+    """Returns total number of deaths, of each run if D holds stacked runs.
+
+    Runs that stopped early are NaN after they stopped, so the last value that is not NaN is used.
+    """
+    D = np.asarray(D, dtype=float)
+    last_idx = D.shape[-1] - 1 - np.argmax(~np.isnan(D[..., ::-1]), axis=-1)
+    return np.take_along_axis(D, np.expand_dims(last_idx, -1), axis=-1)[..., 0]
 
 
 def find_infections_peak(t, I):
-    """Finds the time and # of infections at the peak of infections."""
-    peak_idx = np.argmax(I)
-    return t[peak_idx], I[peak_idx]
+    """Finds the time and # of infections at the peak of infections, of each run if I holds stacked runs."""
+    I = np.asarray(I)
+    peak_idx = np.nanargmax(I, axis=-1)
+    return np.asarray(t)[peak_idx], np.nanmax(I, axis=-1)
 
 
 def plot(t, S, I, R, D, save_plot, title, parameters):
@@ -59,6 +69,8 @@ def plot(t, S, I, R, D, save_plot, title, parameters):
     FONT_SIZE = 11
     set_plot_display_settings(WIDTH, HEIGHT, FONT_SIZE)
 
+    # Draw on a new figure, so runs plotted one after the other never share one
+    figure = plt.figure()
     plt.plot(t, S, label='Susceptible', color='b')
     plt.plot(t, I, label='Infected', color='r')
     plt.plot(t, R, label='Recovered', color='g')
@@ -68,19 +80,25 @@ def plot(t, S, I, R, D, save_plot, title, parameters):
     plt.ylabel('Number of inmates')
     plt.title(title)
     plt.legend()
-    plt.show()
 
-    # Save plot if wanted
+    # Save plot if wanted, before showing it, since closing the shown window clears the figure
     if save_plot:
         # Place plots in folder 'plots'
         if not os.path.exists('plots'):
             os.makedirs('plots')
-        filename = f'{title}'.replace(" ", "_").replace(":", "_")
+        filename = plot_filename(title)
         plt.savefig(f'plots/{filename}.png')
         print(f'Plot saved with filename: {filename}.png')
+    plt.show()
+    plt.close(figure)
 
 
 # Helper functions
+def plot_filename(title):
+    """Returns the file name, without extension, that a plot with title is saved under."""
+    return f'{title}'.replace(" ", "_").replace(":", "_")
+
+
 def set_plot_display_settings(plot_width, plot_height, font_size):
     plt.rcParams.update({"figure.figsize": (plot_width, plot_height)})
     plt.rcParams.update({'font.size': font_size})
@@ -0,0 +1,128 @@
+import multiprocessing
+import os
+import warnings
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from analysis import count_total_deaths, count_total_infected, find_infections_peak, plot_filename
+
+COMPARTMENTS = ('S', 'I', 'R', 'D')
+
+# Label and color of each compartment's curve, as in analysis.plot
+CURVES = {'S': ('Susceptible', 'b'), 'I': ('Infected', 'r'), 'R': ('Recovered', 'g'), 'D': ('Deaths', 'k')}
+
+
+def summarize_runs(t, runs, quantiles=(0.05, 0.95)):
+    """Computes the statistics of analysis.summary for every run at once, and the mean and bands across runs.
+
+    Args:
+        t: times at which runs are given
+        runs: dict mapping 'S', 'I', 'R', 'D' to (# of runs, len(t)) arrays, as returned by ensemble.run_ensemble or
+            result_store.ResultStore.stack
+        quantiles: quantiles of the bands around the mean
+
+    Returns:
+        dict with, for each run, arrays of:
+            total_infected: total # of infections
+            total_deaths: total # of deaths
+            peak_time: time at which infections peaked
+            peak_infected: # of infected at the peak
+        and, for each of 'S', 'I', 'R', 'D', the mean across runs at each time under 'mean' and the
+        (len(quantiles), len(t)) quantiles under 'bands', leaving out runs that stopped early from the times after they
+        stopped
+    """
+    peak_time, peak_infected = find_infections_peak(t, runs['I'])
+    aggregated = {compartment: mean_and_bands(runs[compartment], quantiles) for compartment in COMPARTMENTS}
+    statistics = {'total_infected': count_total_infected(runs['I']), 'total_deaths': count_total_deaths(runs['D']),
+                  'peak_time': peak_time, 'peak_infected': peak_infected,
+                  'mean': {compartment: mean for compartment, (mean, _) in aggregated.items()},
+                  'bands': {compartment: bands for compartment, (_, bands) in aggregated.items()}}
+
+    # Print statistics across runs
+    print(f'{"#"*15} Results of {len(peak_time)} runs {"#"*15}')
+    for name in ('total_infected', 'total_deaths', 'peak_time', 'peak_infected'):
+        low, high = np.quantile(statistics[name], (quantiles[0], quantiles[-1]))
+        print(f'{name}: mean {np.mean(statistics[name]):.1f}, [{low:.1f}, {high:.1f}]')
+
+    return statistics
+
+
+def summarize_groups(store, parameter, time_grid=None, quantiles=(0.05, 0.95)):
+    """Summarizes the runs of a result_store.ResultStore separately for each value of parameter.
+
+    Args:
+        store: result_store.ResultStore holding the runs
+        parameter: name of the parameter whose values group runs, e.g. 'release_number'
+        time_grid: times to align runs on. If not passed, uses the times of the first run of each group
+
+    Returns:
+        dict mapping each value of parameter to a tuple of the group's time grid and the dict returned by
+        summarize_runs
+    """
+    values = sorted({entry['parameters'].get(parameter) for entry in store.index}, key=str)
+    summaries = {}
+    for value in values:
+        print(f'{parameter} = {value}:')
+        t, runs = store.stack(store.select(**{parameter: value}), time_grid)
+        summaries[value] = (t, summarize_runs(t, runs, quantiles))
+    return summaries
+
+
+def render_figures(figures, directory='plots', processes=None):
+    """Writes figures to PNG files in parallel, without any window or interactive backend.
+
+    Each figure shows the S, I, R, D curves of one run, or the mean and bands of stacked runs. Figures are drawn with
+    matplotlib's Agg canvas rather than pyplot, so workers keep no global figure state and never block on a display.
+
+    Args:
+        figures: list of (title, t, curves) tuples, where curves maps 'S', 'I', 'R', 'D' to 1-D arrays of one run,
+            or to (# of runs, len(t)) arrays of stacked runs, e.g. from result_store.ResultStore.stack
+        directory: directory the figures are written to, named after their titles as by analysis.plot
+        processes: # of worker processes. If not passed, uses # of CPUs. If 1, renders in this process
+
+    Returns:
+        list of paths of the written figures
+    """
+    os.makedirs(directory, exist_ok=True)
+    tasks = [(title, t, curves, directory) for title, t, curves in figures]
+    if processes == 1:
+        paths = [render_figure(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            paths = pool.map(render_figure, tasks)
+    print(f'Rendered {len(paths)} figures to {directory}.')
+    return paths
+
+
+# Helper functions
+def mean_and_bands(values, quantiles):
+    """Returns the mean and quantiles across stacked runs at each time, leaving out runs that are NaN after stopping."""
+    with warnings.catch_warnings():  # Times at which all runs stopped are NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmean(values, axis=0), np.nanquantile(values, quantiles, axis=0)
+
+
+def render_figure(task):
+    """Draws one figure of render_figures and writes it to a PNG file."""
+    title, t, curves, directory = task
+    figure = Figure(figsize=(6, 4))
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    for compartment in COMPARTMENTS:
+        label, color = CURVES[compartment]
+        values = np.asarray(curves[compartment])
+        if values.ndim == 1:
+            axes.plot(t, values, label=label, color=color)
+        else:  # Mean and 5-95% band of stacked runs
+            mean, (low, high) = mean_and_bands(values, (0.05, 0.95))
+            axes.plot(t, mean, label=label, color=color)
+            axes.fill_between(t, low, high, color=color, alpha=0.2, linewidth=0)
+    axes.set_xlabel('Time')
+    axes.set_ylabel('Number of inmates')
+    axes.set_title(title)
+    axes.legend()
+    path = os.path.join(directory, f'{plot_filename(title)}.png')
+    figure.savefig(path)
+    return path
@@ -0,0 +1,296 @@
+import inspect
+
+import networkx as nx
+import numpy as np
+import scipy.sparse
+
+from compartments import INFECTED, RECOVERED, SUSCEPTIBLE, VACANT
+from end_to_end import end_to_end
+from ensemble import aggregate_runs
+
+# Largest probability that an inmate gets infected in one time slice, when all of its neighbors are infected, from
+# which the # of time slices each time step is split into is chosen
+MAX_INFECTION_PROBABILITY = 0.1
+
+# end_to_end parameters that the batched engine uses
+BATCHED_PARAMETERS = ('background_inmate_turnover', 'death_rate', 'tau', 'gamma', 'rho', 'max_time', 'percent_infected',
+                      'percent_recovered', 'social_distance', 'social_distance_tau', 'initial_infected_list')
+
+
+def run_batched(num_replicates, release_number, number_infected_before_release, stop_inflow_at_intervention,
+                seed=None, time_grid=None, quantiles=(0.05, 0.95), N=3000, p=0.02, custom_graph=None,
+                steps_per_day=None, **kwargs):
+    """Runs replicates of the same prison in lockstep in this process, and aggregates them as run_ensemble does.
+
+    Trades the exact event times of end_to_end for throughput: see batched_simulation for the approximation made.
+
+    Args:
+        steps_per_day: # of time slices each time step is split into. If not passed, chosen by batched_simulation
+        **kwargs: other end_to_end parameters (see BATCHED_PARAMETERS)
+        other arguments: same as run_ensemble
+
+    Returns:
+        t, runs, mean, bands: same as run_ensemble
+    """
+    unknown = set(kwargs) - set(BATCHED_PARAMETERS)
+    if unknown:
+        raise ValueError(f'The batched engine only takes {BATCHED_PARAMETERS}, got {sorted(unknown)}')
+    parameters = {name: parameter.default for name, parameter in inspect.signature(end_to_end).parameters.items()
+                  if name in BATCHED_PARAMETERS}
+    parameters.update(kwargs)
+    seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    graph_seed, batch_seed = seed_sequence.spawn(2)
+
+    # Build base graph once for all replicates, as run_ensemble does
+    if custom_graph is not None:
+        G = custom_graph
+    else:
+        G = nx.fast_gnp_random_graph(N, p, seed=int(graph_seed.generate_state(1)[0]))
+
+    t, *results = batched_simulation(G, parameters['tau'], parameters['gamma'], parameters['rho'],
+                                     parameters['max_time'], number_infected_before_release, release_number,
+                                     parameters['background_inmate_turnover'], stop_inflow_at_intervention, p,
+                                     parameters['death_rate'], parameters['percent_infected'],
+                                     parameters['percent_recovered'], parameters['social_distance'],
+                                     parameters['social_distance_tau'], parameters['initial_infected_list'],
+                                     num_replicates, np.random.default_rng(batch_seed), time_grid, steps_per_day)
+
+    return (t, *aggregate_runs(np.stack(results, axis=1), quantiles))
+
+
+def batched_simulation(G, tau, gamma, rho, max_time, number_infected_before_release, release_number,
+                       background_inmate_turnover, stop_inflow_at_intervention, p, death_rate, percent_infected,
+                       percent_recovered, social_distance, social_distance_tau, initial_infected_list, num_replicates,
+                       rng=None, time_grid=None, steps_per_day=None):
+    """Advances num_replicates replicates of simulation on G at once, with vectorized tau-leaping.
+
+    The state of every replicate is one row of a (replicates, inmate slots) array. Each time step is split into
+    steps_per_day time slices. In each slice, the # of infected neighbors of every inmate in every replicate is a
+    single sparse matrix product, and each susceptible inmate with k infected neighbors gets infected with probability
+    1 - exp(-tau * k * dt), while each infected inmate recovers with probability 1 - exp(-gamma * dt). This
+    approximates the exact event times of simulation, with an error that shrinks as steps_per_day grows: inmates
+    infected in a slice only become infectious in the next one, which slows the early growth of the outbreak.
+
+    Intake, releases and interventions happen at each integer time exactly as in simulation, as masked operations on
+    all replicates at once. Each replicate meets the release condition at its own time. Every inmate that can ever be
+    admitted has its own slot, with edges drawn up front: new inmates connect to every other inmate with probability
+    p, including when G is a networks.PrisonNetwork. Replicates share the edges of G and of new inmates, as they share
+    G in run_ensemble.
+
+    Args:
+        G: networkx graph or networks.CSRGraph of the inmates initially
+        num_replicates: # of replicates to run
+        rng: numpy Generator used for all random draws
+        time_grid: times at which results are given. If not passed, uses every integer time from 0 to max_time
+        steps_per_day: # of time slices each time step is split into. If not passed, uses the fewest slices for which an
+            inmate of G whose neighbors are all infected gets infected with probability at most
+            MAX_INFECTION_PROBABILITY in a slice, so the error stays small however fast the outbreak spreads
+        other arguments: same as simulation
+
+    Returns:
+        t: time grid
+        S, I, R, D: (num_replicates, len(t)) arrays of # of susceptible, infected, recovered and dead inmates of each
+            replicate at each time
+    """
+    print(f'Starting batched simulation of {num_replicates} replicates...')
+    rng = np.random.default_rng() if rng is None else rng
+    time_grid = np.arange(max_time + 1) if time_grid is None else time_grid
+    num_inmates = G.number_of_nodes()
+    num_slots = num_inmates + max(max_time - 1, 0) * max(background_inmate_turnover, 0)
+    adjacency = batched_adjacency(G, num_slots, p, rng)
+
+    # Choose time slices short enough that the most connected inmate is unlikely to get infected in one slice
+    if steps_per_day is None:
+        max_tau = max(tau, social_distance_tau) if social_distance else tau
+        max_degree = adjacency[:num_inmates, :num_inmates].getnnz(axis=1).max(initial=0)
+        steps_per_day = max(int(np.ceil(max_tau * max_degree / -np.log1p(-MAX_INFECTION_PROBABILITY))), 1)
+        print(f'Using {steps_per_day} time slices per time step.')
+    dt = 1 / steps_per_day
+
+    # Set initial infections of each replicate
+    state = np.full((num_replicates, num_slots), VACANT, dtype=np.int8)
+    state[:, :num_inmates] = SUSCEPTIBLE
+    if initial_infected_list is not None:
+        print('Using initial infected list to set initial infected.')
+        slot_of = {node: slot for slot, node in enumerate(G.nodes)}
+        state[:, [slot_of[node] for node in initial_infected_list]] = INFECTED
+    else:
+        print('Using rho to set initial infected.')
+        num_infected = int(np.ceil(rho * num_inmates))
+        infected_slots = np.argsort(rng.random((num_replicates, num_inmates)), axis=1)[:, :num_infected]
+        np.put_along_axis(state, infected_slots, INFECTED, axis=1)
+
+    release_occurred = np.zeros(num_replicates, dtype=bool)
+    replicate_tau = np.full(num_replicates, float(tau))
+    num_slices = max_time * steps_per_day
+    counts = np.zeros((num_slices + 1, 3, num_replicates), dtype=np.int64)
+    delta_recovered = np.zeros((num_slices + 1, num_replicates), dtype=np.int64)
+    counts[0] = count_states(state)
+
+    # Loop over time slices
+    for k in range(1, num_slices + 1):
+        # Infect and recover inmates. Once no replicate has an infected inmate, only turnover changes the state
+        infected = state == INFECTED
+        if infected.any():
+            num_infected_neighbors = adjacency @ infected.T.astype(np.float32)  # (slots, replicates)
+            exposed = np.flatnonzero((state == SUSCEPTIBLE) & (num_infected_neighbors.T > 0))
+            rows, slots = np.divmod(exposed, num_slots)
+            infection_probability = -np.expm1(-replicate_tau[rows] * dt * num_infected_neighbors[slots, rows])
+            infected_now = exposed[rng.random(len(exposed)) < infection_probability]
+            recovering = np.flatnonzero(infected)
+            recovered_now = recovering[rng.random(len(recovering)) < -np.expm1(-gamma * dt)]
+            state.ravel()[infected_now] = INFECTED
+            state.ravel()[recovered_now] = RECOVERED
+
+        # Add and release inmates at each integer time, as simulation does until the last one
+        i = k // steps_per_day
+        if k % steps_per_day == 0 and i < max_time:
+            num_infected = np.count_nonzero(state == INFECTED, axis=1)
+
+            # Check if release condition has been met in each replicate
+            triggered = ~release_occurred & (num_infected >= number_infected_before_release)
+            release_occurred |= triggered
+            release_numbers = np.full(num_replicates, background_inmate_turnover)
+            if release_number:
+                release_numbers[triggered] += release_number
+            if social_distance:
+                replicate_tau[release_occurred] = social_distance_tau
+            birth_numbers = np.full(num_replicates, max(background_inmate_turnover, 0))
+            if stop_inflow_at_intervention:
+                birth_numbers[release_occurred] = 0
+
+            num_recovered_released = release_batch(state, release_numbers, death_rate, rng)
+            first_slot = num_inmates + (i - 1) * max(background_inmate_turnover, 0)
+            num_recovered_added = admit_batch(state, first_slot, birth_numbers, percent_infected, percent_recovered,
+                                              rng)
+            delta_recovered[k] = num_recovered_added - num_recovered_released
+        counts[k] = count_states(state)
+    print(f'Release condition met in {np.count_nonzero(release_occurred)} of {num_replicates} replicates.')
+
+    # Deaths are a percent of recovered inmates, not counting recovered inmates added or released
+    cumulative_delta_recovered = np.cumsum(delta_recovered, axis=0)
+    D = np.ceil((counts[:, RECOVERED] - cumulative_delta_recovered) * death_rate)
+    S, I, R = counts[:, SUSCEPTIBLE], counts[:, INFECTED], counts[:, RECOVERED] - D
+
+    # Align results on fixed times, taking the state after the last time slice at or before each time
+    idx = np.clip(np.floor(np.asarray(time_grid) * steps_per_day + 1e-9).astype(np.int64), 0, num_slices)
+
+    print('Simulation completed.\n')
+    return np.asarray(time_grid), S[idx].T, I[idx].T, R[idx].T, D[idx].T
+
+
+# Helper functions
+def batched_adjacency(G, num_slots, p, rng):
+    """Returns the symmetric (num_slots, num_slots) sparse adjacency matrix of all inmates that can ever be present.
+
+    The first slots hold the nodes of G, in order. Each later slot, for an inmate admitted later, connects to every
+    slot before it with probability p, so every inmate present at once is connected as by add_nodes.
+    """
+    num_inmates = G.number_of_nodes()
+    slot_of = {node: slot for slot, node in enumerate(G.nodes)}
+    edges = np.array([(slot_of[u], slot_of[v]) for u, v in G.edges], dtype=np.int64).reshape(-1, 2)
+
+    # Draw edges of new inmates, as distinct pairs (i, j) with i < j and j >= num_inmates
+    pair_offsets = (np.arange(num_inmates, num_slots + 1) * np.arange(num_inmates - 1, num_slots) -
+                    num_inmates * (num_inmates - 1)) // 2
+    num_pairs = int(pair_offsets[-1])
+    if num_pairs > 0 and p > 0:
+        pairs = rng.choice(num_pairs, rng.binomial(num_pairs, p), replace=False)
+        targets = np.searchsorted(pair_offsets, pairs, side='right') - 1
+        sources = pairs - pair_offsets[targets]
+        edges = np.concatenate([edges, np.column_stack([sources, targets + num_inmates])])
+
+    rows = np.concatenate([edges[:, 0], edges[:, 1]])
+    columns = np.concatenate([edges[:, 1], edges[:, 0]])
+    return scipy.sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)),
+                                   shape=(num_slots, num_slots))
+
+
+def count_states(state):
+    """Returns the # of susceptible, infected and recovered inmates of each replicate."""
+    return [np.count_nonzero(state == compartment, axis=1) for compartment in (SUSCEPTIBLE, INFECTED, RECOVERED)]
+
+
+def release_batch(state, release_numbers, death_rate, rng):
+    """Releases release_numbers[r] inmates from each replicate r, drawn as by release_from_store.
+
+    In each replicate, released inmates are drawn uniformly among susceptible, infected and recovered (not dead)
+    inmates. Which recovered inmates are dead is not tracked, so recovered inmates are drawn by first drawing how many
+    of the alive ones are released, then which recovered inmates those are.
+
+    Returns:
+        array of # of recovered inmates released from each replicate
+    """
+    num_susceptible, num_infected, num_recovered = count_states(state)
+    num_recovered_not_dead = np.floor(num_recovered * (1 - death_rate)).astype(np.int64)
+    num_alive = num_susceptible + num_infected + num_recovered_not_dead
+    release_numbers = np.maximum(release_numbers, 0)
+    if np.any(release_numbers > num_alive):
+        raise Exception(
+            'All inmates died or got released from prison :( Try turning down max_time or background '
+            'turnover rate')
+
+    # Draw positions among alive inmates, ordered susceptible, infected, then recovered
+    rows, positions = sample_distinct(num_alive, release_numbers, rng)
+    is_susceptible = positions < num_susceptible[rows]
+    is_infected = ~is_susceptible & (positions < (num_susceptible + num_infected)[rows])
+    is_recovered = ~is_susceptible & ~is_infected
+    num_recovered_released = np.bincount(rows[is_recovered], minlength=len(state))
+    recovered_rows, recovered_positions = sample_distinct(num_recovered, num_recovered_released, rng)
+
+    # Find the slot of each drawn inmate, then free all slots at once
+    released = [member_slots(state == SUSCEPTIBLE, rows[is_susceptible], positions[is_susceptible]),
+                member_slots(state == INFECTED, rows[is_infected],
+                             positions[is_infected] - num_susceptible[rows[is_infected]]),
+                member_slots(state == RECOVERED, recovered_rows, recovered_positions)]
+    for released_rows, released_slots in released:
+        state[released_rows, released_slots] = VACANT
+
+    return num_recovered_released
+
+
+def admit_batch(state, first_slot, birth_numbers, percent_infected, percent_recovered, rng):
+    """Admits birth_numbers[r] inmates into each replicate r, in the slots from first_slot on, drawn as by
+    admit_to_store.
+
+    Returns:
+        array of # of recovered inmates added to each replicate
+    """
+    num_slots = birth_numbers.max(initial=0)
+    if num_slots == 0:
+        return np.zeros(len(state), dtype=np.int64)
+    percent_susceptible = 1 - percent_infected - percent_recovered
+    new_states = rng.choice(np.array([SUSCEPTIBLE, INFECTED, RECOVERED], dtype=np.int8),
+                            size=(len(state), num_slots), p=[percent_susceptible, percent_infected, percent_recovered])
+    admitted = np.arange(num_slots) < birth_numbers[:, None]
+    new_slots = state[:, first_slot:first_slot + num_slots]
+    new_slots[admitted] = new_states[admitted]
+    return np.count_nonzero(admitted & (new_states == RECOVERED), axis=1)
+
+
+def sample_distinct(population_sizes, sample_sizes, rng):
+    """Draws sample_sizes[r] distinct positions in range(population_sizes[r]) for each r, without replacement.
+
+    Returns:
+        rows: r of each drawn position, in increasing order
+        positions: drawn positions
+    """
+    rows = np.repeat(np.arange(len(sample_sizes)), sample_sizes)
+    positions = np.floor(rng.random(len(rows)) * population_sizes[rows]).astype(np.int64)
+
+    # Redraw repeated positions until all positions of each r are distinct
+    while True:
+        keys = rows * (int(np.max(population_sizes, initial=0)) + 1) + positions
+        order = np.argsort(keys, kind='stable')
+        repeated = order[1:][keys[order[1:]] == keys[order[:-1]]]
+        if len(repeated) == 0:
+            return rows, positions
+        positions[repeated] = np.floor(rng.random(len(repeated)) * population_sizes[rows[repeated]])
+
+
+def member_slots(members, rows, ranks):
+    """Returns the rows and slots of the ranks[j]-th True entry of row rows[j] of the boolean array members."""
+    cumulative = np.cumsum(members, axis=None)
+    row_starts = np.concatenate([[0], cumulative[members.shape[1] - 1::members.shape[1]]])
+    flat = np.searchsorted(cumulative, row_starts[rows] + ranks + 1)
+    return rows, flat % members.shape[1]
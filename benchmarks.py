@@ -0,0 +1,273 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import networkx as nx
+import numpy as np
+
+from compartments import INFECTED, RECOVERED, SUSCEPTIBLE, CompartmentStore
+from networks import prison_network
+from simulation import add_nodes, calculate_deaths, process_data, remove_nodes, simulation
+
+SEED = 0
+
+# # of most recent passing runs whose median time each case is compared against
+BASELINE_RUNS = 5
+
+# Parameters of each benchmark case, as (quick mode cases, full mode cases)
+SIMULATION_CASES = (
+    [dict(N=1000, p=0.02, max_time=30, turnover=20), dict(N=3000, p=0.02, max_time=30, turnover=20)],
+    [dict(N=N, p=20 / N, max_time=60, turnover=20) for N in (1000, 3000, 10000, 30000, 100000)] +
+    [dict(N=3000, p=p, max_time=60, turnover=20) for p in (0.005, 0.02, 0.05)] +
+    [dict(N=3000, p=0.02, max_time=max_time, turnover=20) for max_time in (30, 120)] +
+    [dict(N=3000, p=0.02, max_time=60, turnover=turnover) for turnover in (0, 100)],
+)
+PRISON_NETWORK_CASES = (
+    [dict(N=20000, max_time=30)],
+    [dict(N=N, max_time=30) for N in (20000, 200000, 1000000)],
+)
+ADD_NODES_CASES = (
+    [dict(N=N, p=20 / N, turnover=turnover) for N in (1000, 10000) for turnover in (20, 200)],
+    [dict(N=N, p=20 / N, turnover=turnover) for N in (1000, 10000, 100000) for turnover in (20, 200, 1000)],
+)
+REMOVE_NODES_CASES = (
+    [dict(N=N, release_number=release_number) for N in (1000, 10000) for release_number in (20, 500)],
+    [dict(N=N, release_number=release_number) for N in (3000, 30000, 100000) for release_number in (20, 500, 1500)],
+)
+PROCESS_DATA_CASES = (
+    [dict(num_events=num_events, max_time=60) for num_events in (10 ** 4, 10 ** 5, 10 ** 6)],
+    [dict(num_events=num_events, max_time=120) for num_events in (10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7)],
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks simulation hot paths and checks for regressions.')
+    parser.add_argument('--quick', action='store_true', help='run small cases only (under a minute)')
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help='fail if a case takes longer than threshold times its median recorded time')
+    parser.add_argument('--min-seconds', type=float, default=0.05,
+                        help='repeat calls to fast cases until each timed run lasts at least this, so they are not '
+                             'mostly noise')
+    parser.add_argument('--history', default='benchmark_history.json', help='JSON file of past benchmark results')
+    parser.add_argument('--repeats', type=int, default=3, help='# of timed runs per case; the best is kept')
+    args = parser.parse_args()
+
+    mode = 0 if args.quick else 1
+    settle_allocator()
+    results = []
+    for name, benchmark, cases in [('simulation', benchmark_simulation, SIMULATION_CASES),
+                                   ('prison_network', benchmark_prison_network, PRISON_NETWORK_CASES),
+                                   ('add_nodes', benchmark_add_nodes, ADD_NODES_CASES),
+                                   ('remove_nodes', benchmark_remove_nodes, REMOVE_NODES_CASES),
+                                   ('process_data', benchmark_process_data, PROCESS_DATA_CASES),
+                                   ('calculate_deaths', benchmark_calculate_deaths, PROCESS_DATA_CASES)]:
+        for parameters in cases[mode]:
+            function, make_args = benchmark(**parameters)
+            seconds, peak_mb = measure(function, make_args, args.repeats, args.min_seconds)
+            results.append({'benchmark': name, 'parameters': parameters, 'seconds': seconds, 'peak_mb': peak_mb})
+            print(f'{name:<18}{format_parameters(parameters):<50}{seconds:>12.6f} s{peak_mb:>10.1f} MB')
+
+    history = load_history(args.history)
+    regressions = find_regressions(results, history, args.threshold)
+    if regressions:
+        # Runs with regressions are not recorded, so they never become the baseline that later runs pass against
+        print(f'\n{len(regressions)} regression(s) over {args.threshold}x the median recorded time:')
+        for result, baseline_seconds in regressions:
+            print(f'\t{result["benchmark"]} {format_parameters(result["parameters"])}: '
+                  f'{baseline_seconds:.6f} s -> {result["seconds"]:.6f} s')
+        sys.exit(1)
+
+    history.append({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': current_commit(), 'quick': args.quick,
+                    'results': results})
+    with open(args.history, 'w') as f:
+        json.dump(history, f, indent=1)
+    print('\nNo regressions.')
+
+
+# Benchmark cases. Each returns the function to time and a function making fresh arguments for each call
+def benchmark_simulation(N, p, max_time, turnover):
+    G = nx.fast_gnp_random_graph(N, p, seed=SEED)
+
+    def run(G, rng):
+        with contextlib.redirect_stdout(io.StringIO()):
+            simulation(G, tau=0.03, gamma=0.07, rho=0.0003, max_time=max_time, number_infected_before_release=N // 10,
+                       release_number=N // 6, background_inmate_turnover=turnover, stop_inflow_at_intervention=False,
+                       p=p, death_rate=0.012, percent_infected=0.0035, percent_recovered=0.0015,
+                       social_distance=True, social_distance_tau=0.015, initial_infected_list=None, rng=rng)
+
+    return run, lambda: (G.copy(), np.random.default_rng(SEED))
+
+
+def benchmark_prison_network(N, max_time):
+    G = prison_network(N, num_facilities=-(-N // 900), seed=SEED)  # Facilities of 1000 beds, about 90% full
+
+    def run(G, rng):
+        with contextlib.redirect_stdout(io.StringIO()):
+            simulation(G, tau=0.05, gamma=0.1, rho=0.0005, max_time=max_time, number_infected_before_release=N // 20,
+                       release_number=N // 10, background_inmate_turnover=N // 300, stop_inflow_at_intervention=False,
+                       p=0, death_rate=0.012, percent_infected=0.0035, percent_recovered=0.0015,
+                       social_distance=True, social_distance_tau=0.025, initial_infected_list=None, rng=rng)
+
+    return run, lambda: (G.copy(), np.random.default_rng(SEED))
+
+
+def benchmark_add_nodes(N, p, turnover):
+    G = nx.fast_gnp_random_graph(N, p, seed=SEED)
+
+    def make_args():
+        # Remove inmates added by the previous call, which is faster than copying G
+        G.remove_nodes_from(range(N, G.graph.get('next_inmate_id', N)))
+        G.graph['next_inmate_id'] = N
+        return G, CompartmentStore(G.nodes), np.random.default_rng(SEED)
+
+    def run(G, store, rng):
+        add_nodes(G, store, turnover, p, 0.0035, 0.0015, rng=rng)
+
+    return run, make_args
+
+
+def benchmark_remove_nodes(N, release_number):
+    G = nx.empty_graph(N)
+
+    def make_args():
+        # Put back inmates released by the previous call. A third of inmates are infected and a third recovered
+        G.add_nodes_from(range(N))
+        store = CompartmentStore()
+        store.add(range(0, N // 3), INFECTED)
+        store.add(range(N // 3, 2 * N // 3), RECOVERED)
+        store.add(range(2 * N // 3, N), SUSCEPTIBLE)
+        return G, store, np.random.default_rng(SEED)
+
+    def run(G, store, rng):
+        remove_nodes(G, store, release_number, 0.012, rng=rng)
+
+    return run, make_args
+
+
+def benchmark_process_data(num_events, max_time):
+    data_list, delta_recovered_list = make_event_data(num_events, max_time)
+    return process_data, lambda: (data_list, delta_recovered_list, 0.012)
+
+
+def benchmark_calculate_deaths(num_events, max_time):
+    data_list, delta_recovered_list = make_event_data(num_events, max_time)
+    t, dict_of_states = data_list[0].summary()
+    return calculate_deaths, lambda: (t, dict_of_states['R'], delta_recovered_list, 0.012)
+
+
+# Helper functions
+class EventData:
+    """Stand-in for a simulation engine, returning fixed event data from summary()."""
+
+    def __init__(self, t, S, I, R):
+        self.t = t
+        self.states = {'S': S, 'I': I, 'R': R}
+
+    def summary(self):
+        return self.t, self.states
+
+
+def make_event_data(num_events, max_time):
+    """Returns data_list and delta_recovered_list of a run with num_events events over max_time time steps."""
+    rng = np.random.default_rng(SEED)
+    t = np.sort(rng.uniform(0, max_time, num_events))
+    t[np.searchsorted(t, np.arange(1, max_time))] = np.arange(1, max_time)  # One row at each integer time
+    R = np.cumsum(rng.random(num_events) < 0.5)
+    I = rng.integers(0, 1000, num_events)
+    S = 10 ** 6 - I - R
+    delta_recovered_list = list(rng.integers(-5, 5, max_time))
+    return [EventData(t, S, I, R)], delta_recovered_list
+
+
+def measure(function, make_args, repeats, min_seconds):
+    """Returns the best wall time in seconds of one call of function over repeats, and its peak traced memory in MB.
+
+    Each timed run calls function enough times in a row to last at least min_seconds, so fast cases are timed as
+    reliably as slow ones.
+    """
+    # Find how many calls make a timed run last at least min_seconds
+    number = 1
+    seconds = time_calls(function, make_args, number)
+    while seconds < min_seconds:
+        number = max(2 * number, int(np.ceil(1.2 * number * min_seconds / max(seconds, 1e-9))))
+        seconds = time_calls(function, make_args, number)
+    times = [seconds] + [time_calls(function, make_args, number) for _ in range(repeats - 1)]
+
+    # Memory is measured in a separate run since tracing slows down the code
+    args = make_args()
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(times) / number, peak / 2 ** 20
+
+
+def settle_allocator():
+    """Frees one large array, so that the allocator keeps memory for arrays of up to tens of MB between calls.
+
+    glibc's malloc raises its thresholds for returning memory to the system the first time a large block is freed.
+    Until then, every call allocating arrays of a few MB faults their pages in again, which made fast cases take 2-3x
+    longer depending on which earlier case happened to free a large block first.
+    """
+    buffer = np.ones(30 * 2 ** 20 // 8)
+    del buffer
+
+
+def time_calls(function, make_args, number):
+    """Returns the total wall time in seconds of number calls of function, each on fresh arguments made untimed."""
+    seconds = 0
+    for _ in range(number):
+        args = make_args()
+        start = time.perf_counter()
+        function(*args)
+        seconds += time.perf_counter() - start
+    return seconds
+
+
+def find_regressions(results, history, threshold):
+    """Returns (result, baseline seconds) for each result slower than threshold times its baseline.
+
+    The baseline of a case is its median time over the last BASELINE_RUNS runs in history that include it. Only
+    passing runs are recorded, so a slow run cannot lower the bar for the runs after it.
+    """
+    regressions = []
+    for result in results:
+        previous_seconds = [previous_result['seconds'] for previous_run in history
+                            for previous_result in previous_run['results']
+                            if previous_result['benchmark'] == result['benchmark']
+                            and previous_result['parameters'] == result['parameters']]
+        if previous_seconds:
+            baseline_seconds = float(np.median(previous_seconds[-BASELINE_RUNS:]))
+            if result['seconds'] > threshold * baseline_seconds:
+                regressions.append((result, baseline_seconds))
+    return regressions
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+def format_parameters(parameters):
+    return ', '.join(f'{name}={value:.3g}' if isinstance(value, float) else f'{name}={value}'
+                     for name, value in parameters.items())
+
+
+if __name__ == '__main__':
+    main()
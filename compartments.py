@@ -0,0 +1,153 @@
+import itertools
+
+import numpy as np
+
+# Compartment codes stored in the status array
+SUSCEPTIBLE = 0
+INFECTED = 1
+RECOVERED = 2
+VACANT = -1  # Slot of a released inmate, waiting to be reused
+STATES = 'SIR'
+
+
+class CompartmentStore:
+    """Array-backed record of which compartment each inmate is in.
+
+    Every inmate occupies a dense slot. The status of each slot is kept in an int8 array, and each compartment keeps a
+    packed array of its slots together with each slot's position in it, so that moving an inmate between compartments
+    or releasing it is O(1) (the last member is swapped into the hole). Slots of released inmates are reused by later
+    intakes, so the arrays only grow with the peak prison population.
+
+    Args:
+        nodes: node IDs of the initial inmates, who all start susceptible
+    """
+
+    def __init__(self, nodes=()):
+        nodes = list(nodes)
+        capacity = max(len(nodes), 16)
+        self.status = np.full(capacity, VACANT, dtype=np.int8)
+        self.node_of_slot = np.full(capacity, -1, dtype=np.int64)
+        self.slot_of = {}
+        self._position = np.zeros(capacity, dtype=np.int64)
+        self._members = [np.zeros(capacity, dtype=np.int64) for _ in STATES]
+        self._sizes = [0] * len(STATES)
+        self._free_slots = []
+        self._num_slots = 0
+        self.add(nodes)
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    def __contains__(self, node):
+        return node in self.slot_of
+
+    def count(self, state):
+        """Returns # of inmates in state."""
+        return self._sizes[state]
+
+    def state(self, node):
+        """Returns the compartment code of node, or VACANT if it is not in prison."""
+        slot = self.slot_of.get(node)
+        return VACANT if slot is None else self.status[slot]
+
+    def members(self, state):
+        """Returns array of node IDs of all inmates in state."""
+        return self.node_of_slot[self._members[state][:self._sizes[state]]]
+
+    def filter(self, nodes, state):
+        """Returns list of the nodes (all of which must be in prison) that are in state."""
+        nodes = list(nodes)
+        if not nodes:
+            return nodes
+        in_state = self.status[[self.slot_of[node] for node in nodes]] == state
+        return list(itertools.compress(nodes, in_state))
+
+    def sample(self, state, number, rng):
+        """Returns array of number node IDs chosen uniformly at random, without replacement, from inmates in state."""
+        positions = rng.choice(self._sizes[state], number, replace=False)
+        return self.node_of_slot[self._members[state][positions]]
+
+    def nodes_at(self, positions):
+        """Returns node IDs at positions of the concatenation of all compartments (S, then I, then R).
+
+        Positions in range(len(self)) enumerate every inmate exactly once, so this maps uniformly drawn integers to
+        uniformly drawn inmates without building the full list of inmates.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        offsets = np.cumsum([0] + self._sizes)
+        states = np.searchsorted(offsets, positions, side='right') - 1
+        slots = np.empty(len(positions), dtype=np.int64)
+        for state in range(len(STATES)):
+            in_state = states == state
+            slots[in_state] = self._members[state][positions[in_state] - offsets[state]]
+        return self.node_of_slot[slots]
+
+    def add(self, nodes, state=SUSCEPTIBLE):
+        """Adds new inmates in state, reusing the slots of released inmates first."""
+        nodes = list(nodes)
+        number = len(nodes)
+        if not number:
+            return
+        num_reused = min(number, len(self._free_slots))
+        reused = [self._free_slots.pop() for _ in range(num_reused)]
+        slots = np.concatenate([np.array(reused, dtype=np.int64),
+                                np.arange(self._num_slots, self._num_slots + number - num_reused)])
+        self._num_slots += number - num_reused
+        self._ensure_capacity(self._num_slots)
+
+        self.status[slots] = state
+        self.node_of_slot[slots] = nodes
+        self.slot_of.update(zip(nodes, slots.tolist()))
+        start = self._sizes[state]
+        self._members[state][start:start + number] = slots
+        self._position[slots] = np.arange(start, start + number)
+        self._sizes[state] += number
+
+    def remove(self, nodes):
+        """Releases inmates, freeing their slots for reuse."""
+        for node in nodes:
+            slot = self.slot_of.pop(node)
+            self._discard(slot, self.status[slot])
+            self.status[slot] = VACANT
+            self._free_slots.append(slot)
+
+    def set_state(self, node, state):
+        """Moves an inmate to state."""
+        slot = self.slot_of[node]
+        self._discard(slot, self.status[slot])
+        self._insert(slot, state)
+        self.status[slot] = state
+
+    # Helper methods
+    def _insert(self, slot, state):
+        position = self._sizes[state]
+        self._members[state][position] = slot
+        self._position[slot] = position
+        self._sizes[state] += 1
+
+    def _discard(self, slot, state):
+        """Swap-removes slot from the packed array of state."""
+        members = self._members[state]
+        last = self._sizes[state] - 1
+        position = self._position[slot]
+        moved_slot = members[last]
+        members[position] = moved_slot
+        self._position[moved_slot] = position
+        self._sizes[state] = last
+
+    def _ensure_capacity(self, num_slots):
+        capacity = len(self.status)
+        if num_slots <= capacity:
+            return
+        while capacity < num_slots:
+            capacity *= 2
+        self.status = _grow(self.status, capacity, VACANT)
+        self.node_of_slot = _grow(self.node_of_slot, capacity, -1)
+        self._position = _grow(self._position, capacity, 0)
+        self._members = [_grow(members, capacity, 0) for members in self._members]
+
+
+def _grow(array, capacity, fill_value):
+    grown = np.full(capacity, fill_value, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
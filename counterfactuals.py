@@ -0,0 +1,151 @@
+import contextlib
+import inspect
+import io
+import pickle
+
+import networkx as nx
+import numpy as np
+
+from end_to_end import end_to_end
+from simulation import initialize_simulation, process_data, simulation_steps
+
+# Parameters that only take effect once the release condition is met, so they can differ between branches
+INTERVENTION_PARAMETERS = ('release_number', 'stop_inflow_at_intervention', 'social_distance', 'social_distance_tau')
+
+
+class Checkpoint:
+    """Complete state of a simulation at the time step the release condition is first met, before interventions.
+
+    Holds the graph, compartments, event queue, random number generator and the steps run so far, which carry the
+    death bookkeeping. Each call to run_branch continues from its own copy of this state, so branches share the same
+    pre-intervention epidemic and the same random numbers from the checkpoint on.
+
+    The state is stored pickled. Unpickling is faster than copying G, and unlike G.copy() it keeps the order of each
+    inmate's neighbors, on which the order of random draws depends.
+
+    Args:
+        G, store, engine, rng: state of the simulation
+        steps: list of steps run so far (the dicts yielded by stream_simulation)
+        time: time step the release condition was met at, or max_time if it was never met
+        parameters: simulation parameters the run was started with, except INTERVENTION_PARAMETERS
+    """
+
+    def __init__(self, G, store, engine, rng, steps, time, parameters):
+        self.state = pickle.dumps((G, store, engine, rng, steps), protocol=pickle.HIGHEST_PROTOCOL)
+        self.time = time
+        self.parameters = parameters
+
+    def restore(self):
+        """Returns new copies of G, store, engine, rng and steps that a branch can run on."""
+        return pickle.loads(self.state)
+
+
+def checkpoint_at_trigger(G, tau, gamma, rho, max_time, number_infected_before_release, background_inmate_turnover, p,
+                          death_rate, percent_infected, percent_recovered, initial_infected_list, rng=None):
+    """Runs a simulation until the release condition is met and returns its Checkpoint.
+
+    Args:
+        same as simulation, except the intervention parameters, which are given to each branch in run_branch
+
+    Returns:
+        Checkpoint of the simulation, which is run to max_time if the release condition is never met
+    """
+    print('Starting simulation...')
+    rng = np.random.default_rng() if rng is None else rng
+    store, engine = initialize_simulation(G, tau, gamma, rho, initial_infected_list, rng, record=True)
+    parameters = dict(max_time=max_time, number_infected_before_release=number_infected_before_release,
+                      background_inmate_turnover=background_inmate_turnover, p=p, death_rate=death_rate,
+                      percent_infected=percent_infected, percent_recovered=percent_recovered)
+
+    # Run until the release condition is met. Interventions are not enacted, so their parameters are not needed
+    steps = []
+    loop = simulation_steps(G, store, engine, max_time, number_infected_before_release, None,
+                            background_inmate_turnover, None, p, death_rate, percent_infected, percent_recovered,
+                            None, None, rng, until_trigger=True)
+    while True:
+        try:
+            steps.append(next(loop))
+        except StopIteration as stop:
+            time = stop.value
+            break
+    print(f'Checkpoint taken at time {time}.')
+
+    return Checkpoint(G, store, engine, rng, steps, time, parameters)
+
+
+def run_branch(checkpoint, release_number, stop_inflow_at_intervention, social_distance, social_distance_tau,
+               time_grid=None):
+    """Continues the simulation of checkpoint to max_time with the given interventions.
+
+    Args:
+        checkpoint: Checkpoint returned by checkpoint_at_trigger, which is left unchanged
+        release_number, stop_inflow_at_intervention, social_distance, social_distance_tau: same as simulation
+        time_grid: If time_grid passed, results are resampled onto it
+
+    Returns:
+        t, S, I, R, D: same as simulation
+    """
+    G, store, engine, rng, steps = checkpoint.restore()
+    parameters = checkpoint.parameters
+    steps += simulation_steps(G, store, engine, parameters['max_time'], parameters['number_infected_before_release'],
+                              release_number, parameters['background_inmate_turnover'], stop_inflow_at_intervention,
+                              parameters['p'], parameters['death_rate'], parameters['percent_infected'],
+                              parameters['percent_recovered'], social_distance, social_distance_tau, rng,
+                              start_time=checkpoint.time, previous_steps=steps)
+
+    # Process raw data into t, S, I, R, D arrays
+    delta_recovered_list = [step['delta_recovered'] for step in steps]
+    return process_data([engine], delta_recovered_list, parameters['death_rate'], time_grid)
+
+
+def run_counterfactuals(branches, number_infected_before_release, seed=None, time_grid=None, custom_graph=None,
+                        **kwargs):
+    """Runs the pre-intervention epidemic once, then each branch of interventions from the shared checkpoint.
+
+    With the same seed, each branch gives exactly the results of end_to_end with that branch's interventions, so
+    branches form paired comparisons: they differ only through their interventions.
+
+    Args:
+        branches: list of dicts of INTERVENTION_PARAMETERS, one per branch. Branches release no inmates and keep the
+            inflow unless they say otherwise, and use the end_to_end defaults for social distancing
+        number_infected_before_release: number of infected at which to perform release on next integer time
+        seed: int or numpy SeedSequence seeding all random draws
+        time_grid: If time_grid passed, results are resampled onto it
+        custom_graph: If custom_graph passed, uses custom_graph. Otherwise, creates graph from N and p
+        **kwargs: other end_to_end parameters shared by all branches, except INTERVENTION_PARAMETERS
+
+    Returns:
+        list of (t, S, I, R, D) tuples, one per branch
+    """
+    parameters = {name: parameter.default for name, parameter in inspect.signature(end_to_end).parameters.items()
+                  if parameter.default is not inspect.Parameter.empty}
+    parameters.update(kwargs)
+    branch_defaults = dict(release_number=0, stop_inflow_at_intervention=False,
+                           social_distance=parameters['social_distance'],
+                           social_distance_tau=parameters['social_distance_tau'])
+    for branch in branches:
+        unknown = set(branch) - set(INTERVENTION_PARAMETERS)
+        if unknown:
+            raise ValueError(f'Branches can only change {INTERVENTION_PARAMETERS}, got {sorted(unknown)}')
+
+    # Build graph as end_to_end does, so results match it for the same seed
+    rng = np.random.default_rng(seed)
+    if custom_graph is not None:
+        G = custom_graph.copy()
+    else:
+        G = nx.fast_gnp_random_graph(parameters['N'], parameters['p'], seed=int(rng.integers(2**32)))
+
+    checkpoint = checkpoint_at_trigger(G, parameters['tau'], parameters['gamma'], parameters['rho'],
+                                       parameters['max_time'], number_infected_before_release,
+                                       parameters['background_inmate_turnover'], parameters['p'],
+                                       parameters['death_rate'], parameters['percent_infected'],
+                                       parameters['percent_recovered'], parameters['initial_infected_list'], rng)
+
+    # Run each branch from the checkpoint
+    results = []
+    for branch in branches:
+        with contextlib.redirect_stdout(io.StringIO()):  # Silence per-branch intervention output
+            results.append(run_branch(checkpoint, time_grid=time_grid, **dict(branch_defaults, **branch)))
+    print(f'Ran {len(branches)} branches from the checkpoint.')
+
+    return results
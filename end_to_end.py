@@ -1,13 +1,18 @@
 import networkx as nx
+import numpy as np
 
 from analysis import summary
+from instrumentation import NULL_PROFILER
+from mean_field import METHODS, mean_field_simulation
 from simulation import simulation
 
 
 def end_to_end(release_number, number_infected_before_release, stop_inflow_at_intervention,
                background_inmate_turnover=20, death_rate=0.012, tau=0.03, gamma=0.07, rho=0.0003, max_time=60,
                N=3000, p=0.02, percent_infected=0.0035, percent_recovered=0.0015, save_plot=False, title='',
-               social_distance=False, social_distance_tau=0.01, custom_graph=None, initial_infected_list=None):
+               social_distance=False, social_distance_tau=0.01, custom_graph=None, initial_infected_list=None,
+               seed=None, summarize=True, time_grid=None, profiler=None, stop_condition=None,
+               method='stochastic'):
     """Runs end-to-end simulation and plots results.
 
     Args:
@@ -28,11 +33,22 @@ def end_to_end(release_number, number_infected_before_release, stop_inflow_at_in
         title: title of plot
         social_distance: boolean flag, if we lower transmission rate after major release
         social_distance_tau: new transmission rate after major release
-        custom_graph: If custom_graph passed, uses custom_graph. Otherwise, creates graph from N and p
+        custom_graph: If custom_graph passed, uses custom_graph, which can be a networks.CSRGraph or PrisonNetwork for
+            large populations. Otherwise, creates graph from N and p
         initial_infected_list: sets node numbers of initial infected. If not passed, rho is used
+        seed: int or numpy SeedSequence seeding all random draws. If not passed, results are not reproducible
+        summarize: should statistics be printed and results plotted?
+        time_grid: If time_grid passed, results are resampled onto it, e.g. np.arange(max_time + 1) for daily values.
+            If stop_condition ends the run early, results at grid times after it stopped are NaN
+        profiler: instrumentation.Profiler timing each phase of the run and notified after every time step
+        stop_condition: stopping.InfectedBelow, stopping.PeakPassed or other function of the steps so far that ends the
+            run early when it returns True
+        method: 'stochastic' for the network simulation, or 'mean_field' or 'pairwise' for a deterministic ODE
+            approximation of it that runs in milliseconds (see mean_field.mean_field_simulation). Deterministic methods
+            ignore seed, profiler and stop_condition
 
     Returns:
-        t: array of times at which events occur
+        t: array of times at which events occur, or time_grid
         S: # of susceptible inmates at each time
         I: # of infected inmates at each time
         R: # of recovered inmates at each time
@@ -40,20 +56,39 @@ def end_to_end(release_number, number_infected_before_release, stop_inflow_at_in
     """
     # Save parameters
     parameters_dict = locals()
+    rng = np.random.default_rng(seed)
+    profiler = NULL_PROFILER if profiler is None else profiler
 
-    # Use custom_graph if passed
-    if custom_graph is not None:
-        G = custom_graph.copy()
-    else:  # Build new graph
-        G = nx.fast_gnp_random_graph(N, p)
+    # Run deterministic approximation, which only needs the size and mean degree of the graph
+    if method in METHODS:
+        if custom_graph is not None:
+            N = custom_graph.number_of_nodes()
+            mean_degree = 2 * custom_graph.number_of_edges() / N
+        else:
+            mean_degree = p * (N - 1)
+        t, S, I, R, D = mean_field_simulation(N, mean_degree, tau, gamma, rho, max_time, number_infected_before_release,
+                                              release_number, background_inmate_turnover, stop_inflow_at_intervention,
+                                              p, death_rate, percent_infected, percent_recovered, social_distance,
+                                              social_distance_tau, initial_infected_list, method, time_grid)
+    elif method == 'stochastic':
+        # Use custom_graph if passed
+        with profiler.phase('build_graph'):
+            if custom_graph is not None:
+                G = custom_graph.copy()
+            else:  # Build new graph
+                G = nx.fast_gnp_random_graph(N, p, seed=int(rng.integers(2**32)))
 
-    # Run simulation
-    t, S, I, R, D = simulation(G, tau, gamma, rho, max_time, number_infected_before_release, release_number,
-                               background_inmate_turnover, stop_inflow_at_intervention, p, death_rate,
-                               percent_infected, percent_recovered, social_distance, social_distance_tau,
-                               initial_infected_list)
+        # Run simulation
+        t, S, I, R, D = simulation(G, tau, gamma, rho, max_time, number_infected_before_release, release_number,
+                                   background_inmate_turnover, stop_inflow_at_intervention, p, death_rate,
+                                   percent_infected, percent_recovered, social_distance, social_distance_tau,
+                                   initial_infected_list, rng, time_grid, profiler, stop_condition)
+    else:
+        raise ValueError(f"Unknown method {method!r}, expected 'stochastic' or one of {METHODS}")
 
     # Print summary of results
-    summary(t, S, I, R, D, save_plot, title, parameters_dict)
+    if summarize:
+        with profiler.phase('summary'):
+            summary(t, S, I, R, D, save_plot, title, parameters_dict)
 
     return t, S, I, R, D
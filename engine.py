@@ -0,0 +1,162 @@
+import heapq
+
+import numpy as np
+
+from compartments import INFECTED, RECOVERED, SUSCEPTIBLE
+
+# Kinds of queued events
+RECOVERY = 0
+TRANSMISSION = 1
+
+
+class EventDrivenSIR:
+    """Event-driven SIR simulation on a graph whose population changes between integer times.
+
+    A single engine owns the pending event queue for the whole run, so inmate arrivals, releases and transmission rate
+    changes are applied to the live queue instead of restarting EoN.fast_SIR at every time unit. Queued events are
+    invalidated lazily: an event is skipped when it is popped if its inmate was released, its source is no longer
+    infected, or it was drawn with an outdated transmission rate. Since all waiting times are exponential, redrawing
+    events from the time of a change leaves the dynamics unchanged.
+
+    Args:
+        G: Networkx graph, mutated by the caller when inmates are added or released
+        tau: transmission rate
+        gamma: recovery rate
+        store: CompartmentStore holding the state of every inmate in G, updated by the engine as events occur
+        tmin: start time
+        rng: numpy Generator used for all random draws
+        record: should S, I, R counts be recorded after every event? If not, no event history is kept
+    """
+
+    def __init__(self, G, tau, gamma, store, tmin=0, rng=None, record=True):
+        self.G = G
+        self.tau = tau
+        self.gamma = gamma
+        self.store = store
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.time = tmin
+        self.record = record
+
+        self._recovery_time = {}  # Recovery time of every infected inmate in prison
+        self._queue = []
+        self.num_events = 0  # Events processed, not counting skipped outdated events
+        self._event_count = 0  # Breaks ties between events scheduled at the same time
+        self._tau_epoch = 0  # Incremented whenever tau changes, invalidating queued transmissions
+
+        # Recorded S, I, R counts after every event
+        self.times, self.S, self.I, self.R = [], [], [], []
+        self._recorded_time = None
+
+        infected = store.members(INFECTED).tolist()
+        for node in infected:
+            self._schedule_recovery(node, tmin)
+        for node in infected:
+            self._schedule_transmissions(node, tmin)
+        self._record()
+
+    def run_until(self, tmax):
+        """Processes all events occurring up to time tmax. Does nothing if the engine has already reached tmax."""
+        if tmax <= self.time:
+            return
+
+        # Record the state at the start of the run, which includes any admissions and releases since the last run
+        if self._recorded_time != self.time:
+            self._record()
+
+        queue = self._queue
+        store = self.store
+        while queue and queue[0][0] <= tmax:
+            time, _, kind, node, source, epoch = heapq.heappop(queue)
+
+            if kind == RECOVERY:
+                if node not in self._recovery_time:  # Inmate was released
+                    continue
+                del self._recovery_time[node]
+                store.set_state(node, RECOVERED)
+            else:
+                if epoch != self._tau_epoch or source not in self._recovery_time or \
+                        store.state(node) != SUSCEPTIBLE:
+                    continue
+                store.set_state(node, INFECTED)
+                self._schedule_recovery(node, time)
+                self._schedule_transmissions(node, time)
+
+            self.time = time
+            self.num_events += 1
+            self._record()
+
+        self.time = tmax
+
+    def set_tau(self, tau):
+        """Changes the transmission rate from the current time on, redrawing all pending transmissions."""
+        self.tau = tau
+        self._tau_epoch += 1
+        for node in list(self._recovery_time):
+            self._schedule_transmissions(node, self.time)
+
+    def admit(self, nodes):
+        """Schedules events for inmates already added to G (with their edges) and to the store at the current time."""
+        new_infected = []
+        for node in nodes:
+            state = self.store.state(node)
+            if state == INFECTED:
+                new_infected.append(node)
+            elif state == SUSCEPTIBLE:
+                # New infected inmates are not scheduled yet, so edges between two new inmates are only scheduled
+                # once, by the new infected inmate below
+                self._expose(node)
+        for node in new_infected:
+            self._schedule_recovery(node, self.time)
+        for node in new_infected:
+            self._schedule_transmissions(node, self.time)
+
+    def release(self, nodes):
+        """Forgets inmates that were removed from G and the store. Their queued events are skipped when popped."""
+        for node in nodes:
+            self._recovery_time.pop(node, None)
+
+    def summary(self):
+        """Returns times and a dict of S, I, R counts, in the format of EoN's Simulation_Investigation.summary()."""
+        return np.array(self.times), {'S': np.array(self.S), 'I': np.array(self.I), 'R': np.array(self.R)}
+
+    # Helper methods
+    def _schedule_recovery(self, node, time):
+        recovery_time = time + self.rng.exponential(1 / self.gamma)
+        self._recovery_time[node] = recovery_time
+        self._push(recovery_time, RECOVERY, node)
+
+    def _schedule_transmissions(self, source, time):
+        """Schedules transmissions from infected source to its susceptible neighbors that happen before it recovers."""
+        if self.tau <= 0:
+            return
+        targets = self.store.filter(self.G.neighbors(source), SUSCEPTIBLE)
+        if not targets:
+            return
+        transmission_times = time + self.rng.exponential(1 / self.tau, len(targets))
+        recovery_time = self._recovery_time[source]
+        for target, transmission_time in zip(targets, transmission_times):
+            if transmission_time < recovery_time:
+                self._push(transmission_time, TRANSMISSION, target, source)
+
+    def _expose(self, node):
+        """Schedules transmissions to a new susceptible node from its infected neighbors."""
+        sources = [neighbor for neighbor in self.G.neighbors(node) if neighbor in self._recovery_time]
+        if not sources or self.tau <= 0:
+            return
+        transmission_times = self.time + self.rng.exponential(1 / self.tau, len(sources))
+        for source, transmission_time in zip(sources, transmission_times):
+            if transmission_time < self._recovery_time[source]:
+                self._push(transmission_time, TRANSMISSION, node, source)
+
+    def _push(self, time, kind, node, source=None):
+        self._event_count += 1
+        heapq.heappush(self._queue, (time, self._event_count, kind, node, source, self._tau_epoch))
+
+    def _record(self):
+        self._recorded_time = self.time
+        if not self.record:
+            return
+        self.times.append(self.time)
+        self.S.append(self.store.count(SUSCEPTIBLE))
+        self.I.append(self.store.count(INFECTED))
+        self.R.append(self.store.count(RECOVERED))
@@ -0,0 +1,146 @@
+import contextlib
+import inspect
+import io
+import multiprocessing
+import warnings
+
+import networkx as nx
+import numpy as np
+
+from end_to_end import end_to_end
+
+COMPARTMENTS = ('S', 'I', 'R', 'D')
+
+# Graph every replicate starts from, set once per worker process by init_worker
+_base_graph = None
+
+
+def run_ensemble(num_replicates, release_number, number_infected_before_release, stop_inflow_at_intervention,
+                 seed=None, processes=None, time_grid=None, quantiles=(0.05, 0.95), N=3000, p=0.02, custom_graph=None,
+                 **kwargs):
+    """Runs independent realizations of end_to_end across a process pool and aggregates them.
+
+    Each replicate gets its own SeedSequence spawned from seed, so results are reproducible and do not depend on the
+    number of processes or on which worker runs which replicate. The base graph is sent to each worker once, when the
+    worker starts, rather than with every task.
+
+    Args:
+        num_replicates: # of realizations to run
+        release_number: # of inmates to release
+        number_infected_before_release: number of infected at which to perform release on next integer time
+        stop_inflow_at_intervention: should we stop the background inflow of inmates at intervention time?
+        seed: int or numpy SeedSequence that all randomness is derived from
+        processes: # of worker processes. If not passed, uses # of CPUs. If 1, runs in this process
+        time_grid: times at which runs are aligned. If not passed, uses every integer time from 0 to max_time
+        quantiles: quantiles of the bands around the mean
+        N: # of inmates initially, if custom_graph is not passed
+        p: probability of contact between inmate and other inmates
+        custom_graph: If custom_graph passed, all replicates start from it. Otherwise, one graph is built from N and p
+        **kwargs: other parameters passed to end_to_end
+
+    Returns:
+        t: time grid
+        runs: dict mapping 'S', 'I', 'R', 'D' to (num_replicates, len(t)) arrays of each replicate
+        mean: dict mapping 'S', 'I', 'R', 'D' to the mean across replicates at each time
+        bands: dict mapping 'S', 'I', 'R', 'D' to (len(quantiles), len(t)) arrays of quantiles at each time
+
+        If a stop_condition in kwargs ends replicates early, their runs are NaN after they stopped, and the mean and
+        bands at each time are over the replicates still running then (NaN once all have stopped).
+    """
+    if time_grid is None:
+        max_time = kwargs.get('max_time', inspect.signature(end_to_end).parameters['max_time'].default)
+        time_grid = np.arange(max_time + 1)
+    seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    graph_seed, *replicate_seeds = seed_sequence.spawn(num_replicates + 1)
+
+    # Build base graph once for all replicates
+    if custom_graph is not None:
+        G = custom_graph
+    else:
+        G = nx.fast_gnp_random_graph(N, p, seed=int(graph_seed.generate_state(1)[0]))
+
+    parameters = dict(kwargs, release_number=release_number,
+                      number_infected_before_release=number_infected_before_release,
+                      stop_inflow_at_intervention=stop_inflow_at_intervention, p=p)
+    tasks = [(replicate_seed, parameters, time_grid) for replicate_seed in replicate_seeds]
+
+    # Run replicates
+    if processes == 1:
+        init_worker(G)
+        results = [run_replicate(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(processes, initializer=init_worker, initargs=(G,)) as pool:
+            results = pool.map(run_replicate, tasks)
+
+    # Aggregate replicates
+    runs, mean, bands = aggregate_runs(np.stack(results), quantiles)
+
+    return time_grid, runs, mean, bands
+
+
+def compare_with_ensemble(num_replicates, release_number, number_infected_before_release, stop_inflow_at_intervention,
+                          method='pairwise', seed=None, processes=None, time_grid=None, quantiles=(0.05, 0.95),
+                          **kwargs):
+    """Reports how far a deterministic method of end_to_end deviates from the mean of the stochastic ensemble.
+
+    Args:
+        method: deterministic method passed to end_to_end, 'mean_field' or 'pairwise'
+        other arguments: same as run_ensemble
+
+    Returns:
+        dict mapping 'S', 'I', 'R', 'D' to dicts with:
+            max_error: largest absolute difference from the ensemble mean at any time
+            relative_error: max_error as a fraction of the largest value of the ensemble mean
+            within_bands: fraction of times at which the deterministic value lies within the ensemble's quantile bands
+    """
+    time_grid, _, mean, bands = run_ensemble(num_replicates, release_number, number_infected_before_release,
+                                             stop_inflow_at_intervention, seed=seed, processes=processes,
+                                             time_grid=time_grid, quantiles=quantiles, **kwargs)
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, *deterministic = end_to_end(release_number, number_infected_before_release, stop_inflow_at_intervention,
+                                       summarize=False, time_grid=time_grid, method=method, **kwargs)
+
+    # Compare each compartment to the ensemble
+    report = {}
+    print(f'{"#"*15} {method} vs. {num_replicates} stochastic runs {"#"*15}')
+    print(f'{"":<4}{"Max error":>12}{"Relative":>12}{"Within bands":>15}')
+    for compartment, values in zip(COMPARTMENTS, deterministic):
+        running = ~np.isnan(mean[compartment])  # Times before all replicates stopped
+        error = np.abs(values - mean[compartment])[running]
+        max_error = error.max()
+        relative_error = max_error / max(mean[compartment][running].max(), 1)
+        within_bands = np.mean((values >= bands[compartment][0]) & (values <= bands[compartment][-1]), where=running)
+        report[compartment] = {'max_error': max_error, 'relative_error': relative_error,
+                               'within_bands': within_bands}
+        print(f'{compartment:<4}{max_error:>12.1f}{relative_error:>12.1%}{within_bands:>15.1%}')
+
+    return report
+
+
+# Helper functions
+def aggregate_runs(stacked, quantiles):
+    """Splits a (# of replicates, 4, # of times) array of S, I, R, D into the runs, mean and bands of run_ensemble.
+
+    Replicates that stopped early are NaN after they stopped, so they are left out of the mean and bands from then on.
+    """
+    runs = {compartment: stacked[:, j] for j, compartment in enumerate(COMPARTMENTS)}
+    with warnings.catch_warnings():  # Times at which all replicates stopped are NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        mean = {compartment: np.nanmean(runs[compartment], axis=0) for compartment in COMPARTMENTS}
+        bands = {compartment: np.nanquantile(runs[compartment], quantiles, axis=0) for compartment in COMPARTMENTS}
+    return runs, mean, bands
+
+
+def init_worker(G):
+    """Stores the base graph in the worker process."""
+    global _base_graph
+    _base_graph = G
+
+
+def run_replicate(task):
+    """Runs one replicate on the worker's base graph and returns its S, I, R, D on the time grid."""
+    seed, parameters, time_grid = task
+    with contextlib.redirect_stdout(io.StringIO()):  # Silence per-run progress output
+        t, S, I, R, D = end_to_end(custom_graph=_base_graph, seed=seed, summarize=False, time_grid=time_grid,
+                                   **parameters)
+    return np.stack([S, I, R, D])
@@ -0,0 +1,98 @@
+import contextlib
+import json
+import os
+import time
+from collections import defaultdict
+
+
+class Profiler:
+    """Collects per-phase wall times, counters and per-step timings of a simulation.
+
+    Pass a Profiler to simulation, stream_simulation or end_to_end to instrument a run. Code paths call phase() around
+    the work they do and count() for what they processed, and the simulation loop calls step() after every time step,
+    which also notifies observers.
+
+    Args:
+        observers: functions called with (step, profiler) after every time step, where step is the dict yielded by
+            stream_simulation
+    """
+
+    def __init__(self, observers=()):
+        self.observers = list(observers)
+        self.phase_times = defaultdict(list)
+        self.counters = defaultdict(int)
+        self.step_times = []
+        self.trace_events = []
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Times the code run inside the with block as one call of phase name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.phase_times[name].append(end - start)
+            self.trace_events.append({'name': name, 'ph': 'X', 'ts': self._microseconds(start),
+                                      'dur': (end - start) * 1e6, 'pid': os.getpid(), 'tid': 0})
+
+    def count(self, name, number=1):
+        """Adds number to counter name."""
+        self.counters[name] += number
+
+    def step(self, step, seconds):
+        """Records the wall time in seconds of the time step that just finished and notifies observers."""
+        now = time.perf_counter()
+        self.step_times.append(seconds)
+        self.trace_events.append({'name': 'counters', 'ph': 'C', 'ts': self._microseconds(now), 'pid': os.getpid(),
+                                  'tid': 0, 'args': dict(self.counters)})
+        for observer in self.observers:
+            observer(step, self)
+
+    def summary(self):
+        """Returns dict with total, mean and max seconds and # of calls of each phase, counters and step times."""
+        phases = {name: {'calls': len(times), 'total': sum(times), 'mean': sum(times) / len(times),
+                         'max': max(times)} for name, times in self.phase_times.items()}
+        steps = {'count': len(self.step_times), 'total': sum(self.step_times),
+                 'mean': sum(self.step_times) / len(self.step_times) if self.step_times else 0,
+                 'max': max(self.step_times, default=0)}
+        return {'phases': phases, 'counters': dict(self.counters), 'steps': steps}
+
+    def print_summary(self):
+        """Prints a table of phase timings, counters and step timings."""
+        summary = self.summary()
+        print(f'{"#"*15} Profile {"#"*18}')
+        print(f'{"Phase":<22}{"Calls":>8}{"Total (s)":>12}{"Mean (ms)":>12}{"Max (ms)":>12}')
+        for name, phase in sorted(summary['phases'].items(), key=lambda item: -item[1]['total']):
+            print(f'{name:<22}{phase["calls"]:>8}{phase["total"]:>12.4f}{phase["mean"] * 1e3:>12.3f}'
+                  f'{phase["max"] * 1e3:>12.3f}')
+        for name, value in summary['counters'].items():
+            print(f'{name}: {value}')
+        steps = summary['steps']
+        print(f'Time steps: {steps["count"]}\n\tMean: {steps["mean"] * 1e3:.3f} ms\n\tMax: {steps["max"] * 1e3:.3f} ms')
+
+    def write_chrome_trace(self, path):
+        """Writes phases and counters to a JSON file that chrome://tracing or Perfetto can open."""
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.trace_events, 'displayTimeUnit': 'ms'}, f)
+
+    def _microseconds(self, seconds):
+        return (seconds - self._start) * 1e6
+
+
+class NullProfiler:
+    """Profiler that does nothing, used when instrumentation is disabled."""
+    _null_context = contextlib.nullcontext()
+
+    def phase(self, name):
+        return self._null_context
+
+    def count(self, name, number=1):
+        pass
+
+    def step(self, step, seconds):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
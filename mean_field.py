@@ -0,0 +1,150 @@
+import EoN
+import numpy as np
+
+from simulation import calculate_deaths, enact_interventions, resample_to_grid
+
+# Deterministic methods, and the # of times reported per time step
+METHODS = ('mean_field', 'pairwise')
+POINTS_PER_STEP = 10
+
+
+def mean_field_simulation(N, mean_degree, tau, gamma, rho, max_time, number_infected_before_release, release_number,
+                          background_inmate_turnover, stop_inflow_at_intervention, p, death_rate, percent_infected,
+                          percent_recovered, social_distance, social_distance_tau, initial_infected_list,
+                          method='pairwise', time_grid=None):
+    """Runs a deterministic approximation of simulation, for screening many parameters quickly.
+
+    Between integer times, the epidemic follows EoN's homogeneous mean-field or pairwise ODEs (the pairwise model also
+    tracks the # of S-I and S-S edges, so it accounts for infected inmates clustering together). At each integer time,
+    the expected # of inmates of each state are released and added exactly as in simulation, and the same release
+    condition and interventions are applied. Edges are updated in expectation, with new inmates connecting to each
+    inmate with probability p, and the mean degree used by the ODEs follows the changing population.
+
+    Args:
+        N: # of inmates initially
+        mean_degree: mean # of contacts of an inmate initially, e.g. p * (N - 1) for a G(N, p) graph
+        method: 'mean_field' or 'pairwise'
+        other arguments: same as simulation
+
+    Returns:
+        t: array of times, or time_grid
+        S: expected # of susceptible inmates at each time
+        I: expected # of infected inmates at each time
+        R: expected # of recovered inmates at each time
+        D: # of dead inmates at each time
+    """
+    if method not in METHODS:
+        raise ValueError(f'Unknown method {method!r}, expected one of {METHODS}')
+    print(f'Starting {method} simulation...')
+
+    # Initial infections are spread uniformly over the graph
+    I = len(initial_infected_list) if initial_infected_list is not None else np.ceil(rho * N)
+    S, R = N - I, 0.0
+    num_edges = mean_degree * N / 2
+    SI = mean_degree * S * I / N  # # of S-I edges
+    SS = mean_degree * S * S / N  # # of S-S edges, counted twice as in EoN
+
+    release_occurred = False
+    background_release_number = background_inmate_turnover
+    times, S_list, I_list, R_list = [], [], [], []
+    delta_recovered_list = []
+    final_state = S, I, R
+
+    # Loop over time
+    for i in range(max_time):
+        # Integrate 1 time unit of the ODEs
+        n = 2 * num_edges / (S + I + R)
+        if method == 'pairwise' and S > 0 and I > 0:
+            t, S_t, I_t, R_t, SI_t, SS_t = EoN.SIR_homogeneous_pairwise(
+                S, I, R, SI, SS, n, tau, gamma, tmin=i, tmax=i + 1, tcount=POINTS_PER_STEP + 1, return_full_data=True)
+            SI, SS = SI_t[-1], SS_t[-1]
+        elif S > 0 and I > 0:
+            t, S_t, I_t, R_t = EoN.SIR_homogeneous_meanfield(S, I, R, n, tau, gamma, tmin=i, tmax=i + 1,
+                                                             tcount=POINTS_PER_STEP + 1)
+        else:  # Only recoveries can happen
+            t = np.linspace(i, i + 1, POINTS_PER_STEP + 1)
+            I_t = I * np.exp(-gamma * (t - i))
+            S_t, R_t = np.full_like(t, S), R + I - I_t
+        S, I, R = S_t[-1], I_t[-1], R_t[-1]
+        final_state = S, I, R
+
+        # Keep the state after turnover at each integer time, as simulation does
+        times.append(t[:-1])
+        S_list.append(S_t[:-1])
+        I_list.append(I_t[:-1])
+        R_list.append(R_t[:-1])
+
+        # Check if release condition has been met
+        if not release_occurred and I >= number_infected_before_release:
+            background_inmate_turnover, r_n, tau = enact_interventions(background_inmate_turnover,
+                                                                       background_release_number, i + 1, I,
+                                                                       release_number, social_distance,
+                                                                       social_distance_tau,
+                                                                       stop_inflow_at_intervention, tau)
+            release_occurred = True
+        else:  # If not, use background release rate
+            r_n = background_release_number
+
+        # Add and release inmates
+        S, I, R, SI, SS, num_edges, delta_recovered = expected_turnover(S, I, R, SI, SS, num_edges,
+                                                                        background_inmate_turnover, r_n, p,
+                                                                        percent_infected, percent_recovered,
+                                                                        death_rate)
+        delta_recovered_list.append(delta_recovered)
+
+    # Add final state, before the last turnover, as simulation does
+    times.append([max_time])
+    for values, final_value in zip((S_list, I_list, R_list), final_state):
+        values.append([final_value])
+    t, S, I, R = [np.concatenate(arrays) for arrays in (times, S_list, I_list, R_list)]
+
+    # Calculate deaths
+    R, D = calculate_deaths(t, R, delta_recovered_list, death_rate)
+
+    # Align results on fixed times
+    if time_grid is not None:
+        S, I, R, D = resample_to_grid(t, time_grid, S, I, R, D)
+        t = np.asarray(time_grid)
+
+    print('Simulation completed.\n')
+    return t, S, I, R, D
+
+
+# Helper functions
+def expected_turnover(S, I, R, SI, SS, num_edges, birth_number, release_number, p, percent_infected,
+                      percent_recovered, death_rate):
+    """Releases and adds the expected # of inmates of each state, updating the expected # of edges of each kind.
+
+    Returns:
+        S, I, R, SI, SS, num_edges after turnover
+        delta_recovered: # of recovered inmates added minus # of recovered inmates released
+    """
+    # Release inmates of each state in proportion to their share of alive inmates
+    if release_number > 0:
+        num_alive = S + I + R * (1 - death_rate)
+        if release_number > num_alive:
+            raise Exception(
+                'All inmates died or got released from prison :( Try turning down max_time or background '
+                'turnover rate')
+        population = S + I + R
+        released_S, released_I, released_R = (release_number * number / num_alive
+                                              for number in (S, I, R * (1 - death_rate)))
+        kept_S = 1 - released_S / S if S > 0 else 0
+        kept_I = 1 - released_I / I if I > 0 else 0
+        SI *= kept_S * kept_I
+        SS *= kept_S ** 2
+        num_edges *= (1 - release_number / population) ** 2
+        S, I, R = S - released_S, I - released_I, R - released_R
+    else:
+        released_R = 0
+
+    # Add inmates with states drawn from the general population, each connecting to every inmate with probability p
+    added_S, added_I, added_R = (birth_number * percent for percent in
+                                 (1 - percent_infected - percent_recovered, percent_infected, percent_recovered))
+    if birth_number > 0:
+        SI += p * (added_S * I + added_I * S + added_S * added_I)
+        SS += p * (2 * added_S * S + added_S * (added_S - 1))
+        num_edges += p * (birth_number * (S + I + R) + birth_number * (birth_number - 1) / 2)
+        S, I, R = S + added_S, I + added_I, R + added_R
+
+    return S, I, R, SI, SS, num_edges, added_R - released_R
@@ -0,0 +1,258 @@
+import contextlib
+import inspect
+import io
+import multiprocessing
+import traceback
+
+import networkx as nx
+import numpy as np
+
+from compartments import INFECTED, RECOVERED, STATES, SUSCEPTIBLE
+from end_to_end import end_to_end
+from simulation import (connect_new_inmates, initialize_simulation, next_inmate_ids, process_data, release_from_store,
+                        simulation_steps)
+
+COMPARTMENTS = ('S', 'I', 'R', 'D')
+
+# end_to_end parameters that each facility can set
+FACILITY_PARAMETERS = ('release_number', 'number_infected_before_release', 'stop_inflow_at_intervention',
+                       'background_inmate_turnover', 'death_rate', 'tau', 'gamma', 'rho', 'N', 'p',
+                       'percent_infected', 'percent_recovered', 'social_distance', 'social_distance_tau',
+                       'custom_graph', 'initial_infected_list')
+
+
+def run_metapopulation(facilities, transfers, max_time=60, seed=None, parallel=True, time_grid=None):
+    """Runs a simulation of several facilities that exchange inmates, each facility in its own worker process.
+
+    Each facility runs the same loop as simulation on its own graph. At each integer time, after its own intake and
+    releases, every facility i sends transfers[i][j] inmates, chosen uniformly among its living inmates, to each
+    facility j. Facilities only exchange the # of transferred inmates in each state, through a pipe to this process,
+    which routes them. Arriving inmates join their new facility at the same integer time, with edges drawn as for
+    new inmates, before the next time step is simulated.
+
+    Args:
+        facilities: list of dicts of end_to_end parameters (see FACILITY_PARAMETERS), one per facility. Parameters not
+            given use the end_to_end defaults. By default, facilities never enact interventions (release_number 0,
+            number_infected_before_release infinite and stop_inflow_at_intervention False)
+        transfers: (# of facilities, # of facilities) array of # of inmates sent from each facility to each other
+            facility at each time step
+        max_time: # of time steps to run simulation
+        seed: int or numpy SeedSequence seeding all random draws. Each facility gets its own spawned seed, so results
+            do not depend on parallel
+        parallel: if True, runs each facility in its own process. Otherwise, runs all facilities in this process
+        time_grid: times at which results are given. If not passed, uses every integer time from 0 to max_time
+
+    Returns:
+        t: time grid
+        facility_results: list of dicts mapping 'S', 'I', 'R', 'D' to arrays of each facility at each time
+        totals: dict mapping 'S', 'I', 'R', 'D' to arrays summed over all facilities at each time
+    """
+    transfers = np.asarray(transfers, dtype=np.int64)
+    if transfers.shape != (len(facilities), len(facilities)):
+        raise ValueError(f'transfers must have shape ({len(facilities)}, {len(facilities)}), got {transfers.shape}')
+    time_grid = np.arange(max_time + 1) if time_grid is None else time_grid
+    seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    facility_seeds = seed_sequence.spawn(len(facilities))
+    specs = [facility_parameters(facility) for facility in facilities]
+
+    # Start facilities, in worker processes or in this process
+    if parallel:
+        channels = []
+        for index, (spec, facility_seed) in enumerate(zip(specs, facility_seeds)):
+            connection, worker_connection = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=facility_worker, daemon=True,
+                                             args=(worker_connection, spec, transfers[index], max_time, facility_seed))
+            worker.start()
+            channels.append(WorkerChannel(connection, worker))
+    else:
+        with contextlib.redirect_stdout(io.StringIO()):  # Silence per-facility progress output
+            channels = [LocalChannel(Facility(spec, transfers[index], max_time, facility_seed))
+                        for index, (spec, facility_seed) in enumerate(zip(specs, facility_seeds))]
+
+    # Loop over time, routing transfers between facilities at each integer time
+    print(f'Starting simulation of {len(facilities)} facilities...')
+    try:
+        incoming = np.zeros((len(facilities), len(STATES)), dtype=np.int64)
+        for _ in range(max_time):
+            for channel, arrivals in zip(channels, incoming):
+                channel.send(('step', arrivals))
+            outgoing = np.stack([channel.receive() for channel in channels])  # (source, destination, state)
+            incoming = outgoing.sum(axis=0)
+
+        # Collect results
+        for channel in channels:
+            channel.send(('results', time_grid))
+        facility_results = [dict(zip(COMPARTMENTS, channel.receive())) for channel in channels]
+    finally:
+        for channel in channels:
+            channel.close()
+    totals = {compartment: sum(results[compartment] for results in facility_results) for compartment in COMPARTMENTS}
+    print('Simulation completed.\n')
+
+    return np.asarray(time_grid), facility_results, totals
+
+
+class Facility:
+    """One facility of a metapopulation run: its graph, compartments, event-driven engine and simulation loop.
+
+    Args:
+        spec: dict of all FACILITY_PARAMETERS
+        transfers: array of # of inmates sent to each facility at each time step
+        max_time: # of time steps to run simulation
+        seed: numpy SeedSequence of the facility
+    """
+
+    def __init__(self, spec, transfers, max_time, seed):
+        self.spec = spec
+        self.transfers = transfers
+        self.rng = np.random.default_rng(seed)
+        if spec['custom_graph'] is not None:
+            self.G = spec['custom_graph'].copy()
+        else:
+            self.G = nx.fast_gnp_random_graph(spec['N'], spec['p'], seed=int(self.rng.integers(2**32)))
+        self.store, self.engine = initialize_simulation(self.G, spec['tau'], spec['gamma'], spec['rho'],
+                                                        spec['initial_infected_list'], self.rng, record=True)
+
+        # Infected inmates can arrive by transfer at any time, so the loop must keep G up to date after extinction
+        self.steps = simulation_steps(self.G, self.store, self.engine, max_time,
+                                      spec['number_infected_before_release'], spec['release_number'],
+                                      spec['background_inmate_turnover'], spec['stop_inflow_at_intervention'],
+                                      spec['p'], spec['death_rate'], spec['percent_infected'],
+                                      spec['percent_recovered'], spec['social_distance'], spec['social_distance_tau'],
+                                      self.rng, fast_forward=False)
+        self.delta_recovered_list = []
+
+    def step(self, arrivals):
+        """Admits inmates that arrived at the current time, runs one time step and sends out transfers.
+
+        Args:
+            arrivals: array of # of susceptible, infected and recovered inmates arriving
+
+        Returns:
+            (# of facilities, 3) array of # of inmates of each state sent to each facility
+        """
+        # Arrivals join at the same integer time as the previous step's intake and releases
+        num_recovered_arrived = self.admit_transfers(arrivals)
+        if self.delta_recovered_list:
+            self.delta_recovered_list[-1] += num_recovered_arrived
+
+        step = next(self.steps)
+        delta_recovered = step['delta_recovered']
+
+        # Send transfers, all at once so each facility receives inmates chosen without replacement
+        outgoing = np.zeros((len(self.transfers), len(STATES)), dtype=np.int64)
+        total = int(self.transfers.sum())
+        if total > 0:
+            released_inmates, num_released = release_from_store(self.store, total, self.spec['death_rate'], self.rng)
+            self.G.remove_nodes_from(released_inmates)
+            self.engine.release(released_inmates)
+            delta_recovered -= int(num_released[RECOVERED])
+
+            # Split the transferred inmates of each state among destinations at random
+            states = np.repeat(np.arange(len(STATES)), num_released)
+            destinations = self.rng.permutation(np.repeat(np.arange(len(self.transfers)), self.transfers))
+            np.add.at(outgoing, (destinations, states), 1)
+        self.delta_recovered_list.append(delta_recovered)
+
+        return outgoing
+
+    def admit_transfers(self, arrivals):
+        """Adds arriving inmates of the given states to G, the store and the engine.
+
+        Returns:
+            # of recovered inmates that arrived
+        """
+        num_arrivals = int(np.sum(arrivals))
+        if num_arrivals == 0:
+            return 0
+        new_inmates = next_inmate_ids(self.G, num_arrivals)
+        connect_new_inmates(self.G, self.store, new_inmates, self.spec['p'], self.rng)
+        start = 0
+        for state, number in zip((SUSCEPTIBLE, INFECTED, RECOVERED), arrivals):
+            self.store.add(new_inmates[start:start + number], state)
+            start += number
+        self.engine.admit(new_inmates)
+        return int(arrivals[RECOVERED])
+
+    def results(self, time_grid):
+        """Returns S, I, R, D arrays of the facility on time_grid."""
+        _, S, I, R, D = process_data([self.engine], self.delta_recovered_list, self.spec['death_rate'], time_grid)
+        return S, I, R, D
+
+
+class LocalChannel:
+    """Runs a Facility in this process behind the same interface as WorkerChannel."""
+
+    def __init__(self, facility):
+        self.facility = facility
+        self._reply = None
+
+    def send(self, message):
+        with contextlib.redirect_stdout(io.StringIO()):  # Silence per-facility progress output
+            self._reply = handle_message(self.facility, message)
+
+    def receive(self):
+        return self._reply
+
+    def close(self):
+        pass
+
+
+class WorkerChannel:
+    """Pipe to a facility worker process."""
+
+    def __init__(self, connection, worker):
+        self.connection = connection
+        self.worker = worker
+
+    def send(self, message):
+        self.connection.send(message)
+
+    def receive(self):
+        succeeded, reply = self.connection.recv()
+        if not succeeded:
+            raise Exception(f'Facility worker failed:\n{reply}')
+        return reply
+
+    def close(self):
+        with contextlib.suppress(OSError):  # The worker may have exited after an error
+            self.connection.send(('stop', None))
+        self.worker.join(timeout=5)
+        if self.worker.is_alive():
+            self.worker.terminate()
+
+
+# Helper functions
+def facility_parameters(facility):
+    """Returns all FACILITY_PARAMETERS of a facility, filling in the end_to_end defaults."""
+    unknown = set(facility) - set(FACILITY_PARAMETERS)
+    if unknown:
+        raise ValueError(f'Facilities can only set {FACILITY_PARAMETERS}, got {sorted(unknown)}')
+    defaults = {name: parameter.default for name, parameter in inspect.signature(end_to_end).parameters.items()
+                if name in FACILITY_PARAMETERS and parameter.default is not inspect.Parameter.empty}
+    return {**defaults, 'release_number': 0, 'number_infected_before_release': np.inf,
+            'stop_inflow_at_intervention': False, **facility}
+
+
+def handle_message(facility, message):
+    """Runs the command in message on facility and returns its reply."""
+    command, argument = message
+    if command == 'step':
+        return facility.step(argument)
+    if command == 'results':
+        return facility.results(argument)
+    raise ValueError(f'Unknown command {command!r}')
+
+
+def facility_worker(connection, spec, transfers, max_time, seed):
+    """Runs a Facility in a worker process, answering commands sent through connection until told to stop."""
+    with contextlib.redirect_stdout(io.StringIO()):  # Silence per-facility progress output
+        try:
+            facility = Facility(spec, transfers, max_time, seed)
+            while True:
+                message = connection.recv()
+                if message[0] == 'stop':
+                    break
+                connection.send((True, handle_message(facility, message)))
+        except Exception:
+            connection.send((False, traceback.format_exc()))
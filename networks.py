@@ -0,0 +1,278 @@
+import numpy as np
+
+# Fraction of adjacency entries that may belong to released inmates or sit outside the CSR arrays before compacting
+COMPACTION_THRESHOLD = 0.25
+
+
+class CSRGraph:
+    """Compact undirected graph stored as a CSR adjacency matrix, for populations too large for Networkx.
+
+    Node IDs index the arrays directly, so they must be non-negative integers, as the simulation's are. Implements the
+    part of the Networkx Graph interface the simulation uses (nodes, neighbors, adding and removing nodes and edges),
+    so it can be passed wherever the simulation takes G.
+
+    Changes do not rebuild the matrix. Released inmates are only marked as gone and skipped when reading neighbors, and
+    new edges are kept in per-node lists next to the CSR arrays. Once these make up more than COMPACTION_THRESHOLD of
+    all adjacency entries, everything is merged into fresh CSR arrays, so the amortized cost of a change is O(1).
+
+    Args:
+        num_nodes: # of nodes, with IDs 0 to num_nodes - 1
+        sources, targets: arrays of the endpoints of each edge. Self-loops and duplicate edges are dropped
+    """
+
+    def __init__(self, num_nodes, sources=(), targets=()):
+        self.graph = {'next_inmate_id': num_nodes}
+        self._present = np.ones(num_nodes, dtype=bool)
+        self._num_nodes = num_nodes
+        self._extra = {}  # Neighbors of each node added since the last compaction
+        self._num_extra = 0
+        self._num_stale = 0  # Adjacency entries of released inmates in the CSR arrays
+        self._build(np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64))
+
+    def __len__(self):
+        return self._num_nodes
+
+    def __contains__(self, node):
+        return 0 <= node < len(self._present) and self._present[node]
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    @property
+    def nodes(self):
+        """List of IDs of nodes in the graph."""
+        return np.flatnonzero(self._present).tolist()
+
+    @property
+    def edges(self):
+        """List of (u, v) pairs, with u < v, of edges in the graph."""
+        sources, targets = self._edge_arrays()
+        return list(zip(sources.tolist(), targets.tolist()))
+
+    def number_of_nodes(self):
+        return self._num_nodes
+
+    def number_of_edges(self):
+        return len(self._edge_arrays()[0])
+
+    def neighbors(self, node):
+        """Returns list of the neighbors of node."""
+        row = self.indices[self.indptr[node]:self.indptr[node + 1]]
+        neighbors = row[self._present[row]].tolist()
+        extra = self._extra.get(node)
+        if extra:
+            neighbors += [neighbor for neighbor in extra if self._present[neighbor]]
+        return neighbors
+
+    def degree(self, node):
+        return len(self.neighbors(node))
+
+    def add_nodes_from(self, nodes):
+        """Adds nodes, which must be new IDs (released inmates' IDs are never reused)."""
+        nodes = np.asarray(list(nodes), dtype=np.int64)
+        if not len(nodes):
+            return
+        if nodes.max() >= len(self._present):
+            self._grow(int(nodes.max()) + 1)
+        self._num_nodes += int(np.count_nonzero(~self._present[nodes]))
+        self._present[nodes] = True
+
+    def add_edges_from(self, edges):
+        """Adds edges from an iterable of (u, v) pairs of nodes already in the graph, which must not be edges yet."""
+        for u, v in edges:
+            if u == v:
+                continue
+            self._extra.setdefault(u, []).append(v)
+            self._extra.setdefault(v, []).append(u)
+            self._num_extra += 2
+        self._compact_if_needed()
+
+    def remove_nodes_from(self, nodes):
+        """Removes nodes and their edges."""
+        nodes = np.asarray(list(nodes), dtype=np.int64)
+        if not len(nodes):
+            return
+        nodes = nodes[self._present[nodes]]
+        self._present[nodes] = False
+        self._num_nodes -= len(nodes)
+        self._num_stale += 2 * int(np.sum(self.indptr[nodes + 1] - self.indptr[nodes]))  # Their rows and columns
+        for node in nodes.tolist():
+            self._num_extra -= len(self._extra.pop(node, ()))
+        self._compact_if_needed()
+
+    def copy(self):
+        """Returns an independent copy of the graph."""
+        graph = CSRGraph.__new__(type(self))
+        graph.__dict__.update(self.__dict__)
+        graph.graph = dict(self.graph)
+        graph._present = self._present.copy()
+        graph._extra = {node: list(neighbors) for node, neighbors in self._extra.items()}
+        return graph  # indptr and indices are never modified in place, so they are shared
+
+    def nbytes(self):
+        """Returns # of bytes used by the adjacency arrays."""
+        return self.indptr.nbytes + self.indices.nbytes + self._present.nbytes
+
+    # Helper methods
+    def _build(self, sources, targets):
+        """Builds the CSR arrays from edges given once each, dropping self-loops and duplicates."""
+        keep = sources != targets
+        sources, targets = sources[keep], targets[keep]
+        rows = np.concatenate([sources, targets])
+        columns = np.concatenate([targets, sources])
+        keys = _sorted_unique(rows * len(self._present) + columns)
+        rows, columns = np.divmod(keys, len(self._present))
+        self.indptr = np.zeros(len(self._present) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(self._present)), out=self.indptr[1:])
+        self.indices = columns.astype(np.int32 if len(self._present) < 2 ** 31 else np.int64)
+
+    def _edge_arrays(self):
+        """Returns arrays of the endpoints (u < v) of every edge between nodes in the graph."""
+        rows = np.repeat(np.arange(len(self.indptr) - 1), np.diff(self.indptr))
+        sources = [rows, np.repeat(np.array(list(self._extra), dtype=np.int64),
+                                   [len(neighbors) for neighbors in self._extra.values()])]
+        targets = [self.indices.astype(np.int64), np.array([neighbor for neighbors in self._extra.values()
+                                                            for neighbor in neighbors], dtype=np.int64)]
+        sources, targets = np.concatenate(sources), np.concatenate(targets)
+        keep = (sources < targets) & self._present[sources] & self._present[targets]
+        return sources[keep], targets[keep]
+
+    def _compact_if_needed(self):
+        if self._num_extra + self._num_stale > COMPACTION_THRESHOLD * max(len(self.indices), 1):
+            self._build(*self._edge_arrays())
+            self._extra = {}
+            self._num_extra = 0
+            self._num_stale = 0
+
+    def _grow(self, min_size):
+        size = max(min_size, 2 * len(self._present))
+        present = np.zeros(size, dtype=bool)
+        present[:len(self._present)] = self._present
+        self._present = present
+        self.indptr = np.concatenate([self.indptr, np.full(size - len(self.indptr) + 1, self.indptr[-1])])
+
+
+class PrisonNetwork(CSRGraph):
+    """CSRGraph of inmates housed in cells, grouped into blocks, grouped into facilities.
+
+    Every inmate occupies a bed. Cellmates are all in contact, and any two inmates of the same block, facility or
+    system are in contact with probability contacts / # of beds in that group, so that an inmate of a full block has
+    block_contacts contacts in its block on average. Beds are numbered so that every cell, block and facility is a
+    contiguous range of beds. New inmates take free beds at random and draw their contacts the same way (see house),
+    and released inmates free their beds.
+
+    Args:
+        num_inmates: # of inmates initially, at most the # of beds
+        num_facilities: # of facilities
+        blocks_per_facility: # of blocks in each facility
+        cells_per_block: # of cells in each block
+        cell_size: # of beds in each cell
+        block_contacts: mean # of contacts of an inmate with other inmates of its full block, besides cellmates
+        facility_contacts: mean # of contacts with inmates of its full facility, e.g. in shared yards and dining halls
+        system_contacts: mean # of contacts with inmates anywhere in the full system, e.g. through transfers or staff
+        rng: numpy Generator used for random draws
+    """
+
+    def __init__(self, num_inmates, num_facilities=1, blocks_per_facility=10, cells_per_block=50, cell_size=2,
+                 block_contacts=8, facility_contacts=2, system_contacts=0.1, rng=None):
+        rng = np.random.default_rng() if rng is None else rng
+        self.cell_size = cell_size
+        self.block_size = cells_per_block * cell_size
+        self.facility_size = blocks_per_facility * self.block_size
+        self.num_beds = num_facilities * self.facility_size
+        self.mean_contacts = [(self.block_size, block_contacts), (self.facility_size, facility_contacts),
+                              (self.num_beds, system_contacts)]
+        if num_inmates > self.num_beds:
+            raise Exception(f'{num_inmates} inmates do not fit in {self.num_beds} beds. Try adding cells')
+
+        # Put inmates in random beds
+        self.bed_of = np.full(num_inmates, -1, dtype=np.int64)
+        self.occupant = np.full(self.num_beds, -1, dtype=np.int64)
+        self.bed_of[:] = rng.choice(self.num_beds, num_inmates, replace=False)
+        self.occupant[self.bed_of] = np.arange(num_inmates)
+
+        sources, targets = self._draw_contacts(np.arange(num_inmates), rng, scale=0.5)
+        super().__init__(num_inmates, sources, targets)
+
+    def house(self, new_inmates, rng):
+        """Adds new inmates to free beds chosen at random and draws their contacts.
+
+        Returns:
+            sources, targets: arrays of the endpoints of the new inmates' edges, which are not added to the graph yet
+        """
+        new_inmates = np.asarray(new_inmates, dtype=np.int64)
+        free_beds = np.flatnonzero(self.occupant < 0)
+        if len(new_inmates) > len(free_beds):
+            raise Exception('No free beds left for new inmates. Try adding cells or turning down background turnover')
+        self.add_nodes_from(new_inmates)
+        if new_inmates.max() >= len(self.bed_of):
+            self.bed_of = np.concatenate([self.bed_of, np.full(max(len(self.bed_of), int(new_inmates.max()) + 1),
+                                                               -1, dtype=np.int64)])
+        beds = rng.choice(free_beds, len(new_inmates), replace=False)
+        self.bed_of[new_inmates] = beds
+        self.occupant[beds] = new_inmates
+        return self._draw_contacts(new_inmates, rng)
+
+    def remove_nodes_from(self, nodes):
+        nodes = np.asarray(list(nodes), dtype=np.int64)
+        nodes = nodes[self._present[nodes]]
+        self.occupant[self.bed_of[nodes]] = -1
+        super().remove_nodes_from(nodes)
+
+    def copy(self):
+        graph = super().copy()
+        graph.bed_of = self.bed_of.copy()
+        graph.occupant = self.occupant.copy()
+        return graph
+
+    # Helper methods
+    def _draw_contacts(self, inmates, rng, scale=1.0):
+        """Returns edges, each given once, from inmates to their cellmates and to random inmates of their groups.
+
+        Each inmate draws Poisson(scale * mean contacts) random beds in its group at each level and keeps the occupied
+        ones. When all inmates draw their contacts at once (scale=0.5), each pair can be drawn from either end, so
+        scale halves the draws to keep the mean # of contacts.
+        """
+        beds = self.bed_of[inmates]
+
+        # Cellmates
+        cell_start = beds - beds % self.cell_size
+        cellmate_beds = cell_start[:, None] + np.arange(self.cell_size)
+        sources = [np.repeat(inmates, self.cell_size)]
+        targets = [self.occupant[cellmate_beds.ravel()]]
+
+        # Random contacts in each group containing the inmate
+        for group_size, mean_contacts in self.mean_contacts:
+            num_contacts = rng.poisson(scale * mean_contacts, len(inmates))
+            contact_sources = np.repeat(inmates, num_contacts)
+            group_start = np.repeat(beds - beds % group_size, num_contacts)
+            sources.append(contact_sources)
+            targets.append(self.occupant[group_start + rng.integers(0, group_size, len(contact_sources))])
+
+        sources, targets = np.concatenate(sources), np.concatenate(targets)
+        keep = (targets >= 0) & (targets != sources)
+        first, second = np.minimum(sources[keep], targets[keep]), np.maximum(sources[keep], targets[keep])
+        keys = _sorted_unique((first << 32) | second)
+        return keys >> 32, keys & (2 ** 32 - 1)
+
+
+def csr_from_networkx(G):
+    """Returns a CSRGraph with the nodes and edges of Networkx graph G, whose nodes must be non-negative ints."""
+    nodes = np.fromiter(G.nodes, dtype=np.int64, count=G.number_of_nodes())
+    edges = np.array(list(G.edges), dtype=np.int64).reshape(-1, 2)
+    graph = CSRGraph(int(nodes.max(initial=-1)) + 1, edges[:, 0], edges[:, 1])
+    graph.remove_nodes_from(np.setdiff1d(np.arange(len(graph._present)), nodes))
+    return graph
+
+
+def prison_network(num_inmates, num_facilities=1, blocks_per_facility=10, cells_per_block=50, cell_size=2,
+                   block_contacts=8, facility_contacts=2, system_contacts=0.1, seed=None):
+    """Returns a PrisonNetwork of num_inmates inmates, seeded with seed. See PrisonNetwork for the arguments."""
+    return PrisonNetwork(num_inmates, num_facilities, blocks_per_facility, cells_per_block, cell_size, block_contacts,
+                         facility_contacts, system_contacts, np.random.default_rng(seed))
+
+
+def _sorted_unique(keys):
+    """Returns the sorted unique values of integer array keys (faster than np.unique on large arrays)."""
+    keys = np.sort(keys)
+    return keys[np.concatenate([[True], keys[1:] != keys[:-1]])] if len(keys) else keys
@@ -0,0 +1,143 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+from simulation import resample_to_grid
+from sweep import to_json
+
+# Columns of every chunk, one row per recorded time of a run
+COLUMNS = ('run_id', 't', 'S', 'I', 'R', 'D')
+
+
+class ResultStore:
+    """On-disk store of simulation results, in columnar chunks read through memory maps.
+
+    Each call to append writes one chunk: a directory holding one .npy file per column of COLUMNS, where the rows of
+    each run are contiguous. A JSON lines index holds, for each run, its chunk, its rows and its parameters, so runs can
+    be selected by parameters without reading any chunk. Chunks are opened as read-only memory maps, so only the rows
+    that are used are read from disk, and thousands of runs can be aggregated without loading them all into memory.
+
+    Chunks are written to a temporary directory and renamed, and a run only exists once its index line is written, so
+    an interrupted append never leaves a partial run in the store, and its temporary directory is removed by the next
+    append. Only one process should append to a store at a time.
+
+    Args:
+        directory: directory of the store, created if it does not exist
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, 'chunks'), exist_ok=True)
+        self.index = []
+        self._chunks = {}
+        if os.path.exists(self._index_path):
+            with open(self._index_path) as f:
+                self.index = [json.loads(line) for line in f if line.strip()]
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def keys(self):
+        """Keys of the runs that were appended with a key, e.g. their sweep cache key."""
+        return {entry['key'] for entry in self.index if entry['key'] is not None}
+
+    def append(self, runs):
+        """Writes runs to a new chunk.
+
+        Args:
+            runs: list of dicts with 't', 'S', 'I', 'R', 'D' arrays, and optionally 'parameters', 'seed' and 'key', as
+                returned by sweep.run_sweep
+
+        Returns:
+            list of run IDs given to runs
+        """
+        if not runs:
+            return []
+        chunk = self._next_chunk()
+        first_run_id = len(self.index)
+        run_ids = list(range(first_run_id, first_run_id + len(runs)))
+        lengths = [len(run['t']) for run in runs]
+
+        # Write columns, with the rows of all runs one after the other
+        columns = {'run_id': np.repeat(np.array(run_ids, dtype=np.int64), lengths)}
+        for name in COLUMNS[1:]:
+            columns[name] = np.concatenate([np.asarray(run[name], dtype=np.float64) for run in runs])
+        temporary_path = os.path.join(self.directory, 'chunks', f'{chunk}.{os.getpid()}.tmp')
+        os.makedirs(temporary_path)
+        for name, column in columns.items():
+            np.save(os.path.join(temporary_path, f'{name}.npy'), column)
+        os.replace(temporary_path, os.path.join(self.directory, 'chunks', chunk))
+
+        # Index runs
+        stops = np.cumsum(lengths)
+        entries = [{'run_id': run_id, 'chunk': chunk, 'start': int(stop - length), 'stop': int(stop),
+                    'parameters': run.get('parameters', {}), 'seed': run.get('seed'), 'key': run.get('key')}
+                   for run_id, run, length, stop in zip(run_ids, runs, lengths, stops)]
+        with open(self._index_path, 'a') as f:
+            for entry in entries:
+                f.write(json.dumps(entry, default=to_json) + '\n')
+        self.index += json.loads(json.dumps(entries, default=to_json))
+
+        return run_ids
+
+    def select(self, **parameters):
+        """Returns the IDs of the runs whose parameters have all the given values, e.g. select(release_number=500)."""
+        parameters = json.loads(json.dumps(parameters, default=to_json))
+        return [entry['run_id'] for entry in self.index
+                if all(entry['parameters'].get(name) == value for name, value in parameters.items())]
+
+    def run(self, run_id):
+        """Returns a dict with the run's 't', 'S', 'I', 'R', 'D' as memory-mapped arrays, 'parameters' and 'seed'."""
+        entry = self.index[run_id]
+        columns = self._open(entry['chunk'])
+        run = {name: columns[name][entry['start']:entry['stop']] for name in COLUMNS[1:]}
+        run.update(parameters=entry['parameters'], seed=entry['seed'])
+        return run
+
+    def stack(self, run_ids=None, time_grid=None):
+        """Aligns runs on a time grid and stacks them, reading each run from its memory map in turn.
+
+        Args:
+            run_ids: IDs of the runs to stack. If not passed, stacks all runs
+            time_grid: times to align runs on. If not passed, uses the times of the first run, which suits runs that
+                were all run with the same time_grid
+
+        Returns:
+            t: time grid
+            runs: dict mapping 'S', 'I', 'R', 'D' to (len(run_ids), len(t)) arrays of each run
+        """
+        run_ids = range(len(self.index)) if run_ids is None else run_ids
+        if time_grid is None:
+            time_grid = np.array(self.run(run_ids[0])['t']) if len(run_ids) else np.array([])
+        stacked = np.empty((4, len(run_ids), len(time_grid)))
+        for j, run_id in enumerate(run_ids):
+            run = self.run(run_id)
+            stacked[:, j] = resample_to_grid(run['t'], time_grid, run['S'], run['I'], run['R'], run['D'])
+        return np.asarray(time_grid), dict(zip('SIRD', stacked))
+
+    # Helper methods
+    @property
+    def _index_path(self):
+        return os.path.join(self.directory, 'index.jsonl')
+
+    def _next_chunk(self):
+        """Returns the name of the next chunk, after removing temporary directories left by interrupted appends."""
+        chunks_path = os.path.join(self.directory, 'chunks')
+        numbers = [-1]
+        for name in os.listdir(chunks_path):
+            if name.endswith('.tmp'):
+                shutil.rmtree(os.path.join(chunks_path, name), ignore_errors=True)
+            elif name.isdigit():
+                numbers.append(int(name))
+        numbers += [int(entry['chunk']) for entry in self.index]
+        return f'{max(numbers) + 1:06d}'
+
+    def _open(self, chunk):
+        """Returns the columns of chunk as read-only memory maps, opening them once."""
+        if chunk not in self._chunks:
+            self._chunks[chunk] = {name: np.load(os.path.join(self.directory, 'chunks', chunk, f'{name}.npy'),
+                                                 mmap_mode='r') for name in COLUMNS}
+        return self._chunks[chunk]
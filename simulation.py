@@ -1,10 +1,17 @@
-import EoN
+import time
+
 import numpy as np
 
+from compartments import INFECTED, RECOVERED, SUSCEPTIBLE, CompartmentStore
+from engine import EventDrivenSIR
+from instrumentation import NULL_PROFILER
+from networks import PrisonNetwork
+
 
 def simulation(G, tau, gamma, rho, max_time, number_infected_before_release, release_number, background_inmate_turnover,
                stop_inflow_at_intervention, p, death_rate, percent_infected, percent_recovered, social_distance,
-               social_distance_tau, initial_infected_list):
+               social_distance_tau, initial_infected_list, rng=None, time_grid=None, profiler=None,
+               stop_condition=None):
     """Runs a simulation on SIR model.
 
     Args:
@@ -24,74 +31,198 @@ def simulation(G, tau, gamma, rho, max_time, number_infected_before_release, rel
         social_distance: boolean flag, if we lower transmission rate after major release
         social_distance_tau: new transmission rate after major release
         initial_infected_list: sets node numbers of initial infected (default is 0, this parameter is arbitrary)
+        rng: numpy Generator used for random draws. If not passed, a new unseeded Generator is used
+        time_grid: If time_grid passed, results are resampled onto it, e.g. np.arange(max_time + 1) for daily values.
+            If stop_condition ends the run early, results at grid times after it stopped are NaN, and as at max_time,
+            results at the time it stopped at are before that time step's inmates are added and released
+        profiler: instrumentation.Profiler timing each phase of the run and notified after every time step
+        stop_condition: function called after every time step with the list of steps so far (the dicts yielded by
+            stream_simulation), e.g. stopping.InfectedBelow. If it returns True, the run ends at that time step
 
     Returns:
-        t: array of times at which events occur
+        t: array of times at which events occur, or time_grid
         S: # of susceptible inmates at each time
         I: # of infected inmates at each time
         R: # of recovered inmates at each time
         D: # of dead inmates at each time step
     """
     print('Starting simulation...')
-    release_occurred = False
-    background_release_number = background_inmate_turnover
-    data_list = []
-    recovered_list = []
-    delta_recovered_list = []
+    rng = np.random.default_rng() if rng is None else rng
+    profiler = NULL_PROFILER if profiler is None else profiler
+    with profiler.phase('initialize'):
+        store, engine = initialize_simulation(G, tau, gamma, rho, initial_infected_list, rng, record=True)
+
+    # Loop over time, tracking the number of recovered inmates added or released at each time step
+    delta_recovered_list = [step['delta_recovered'] for step in
+                            simulation_steps(G, store, engine, max_time, number_infected_before_release,
+                                             release_number, background_inmate_turnover,
+                                             stop_inflow_at_intervention, p, death_rate, percent_infected,
+                                             percent_recovered, social_distance, social_distance_tau, rng, profiler,
+                                             stop_condition)]
+
+    # Process raw data into t, S, I, R, D arrays, up to the time step the run stopped at
+    stop_time = len(delta_recovered_list) if len(delta_recovered_list) < max_time else None
+    with profiler.phase('process_data'):
+        t, S, I, R, D = process_data([engine], delta_recovered_list, death_rate, time_grid, stop_time)
+
+    print('Simulation completed.\n')
+    return t, S, I, R, D
+
+
+def stream_simulation(G, tau, gamma, rho, max_time, number_infected_before_release, release_number,
+                      background_inmate_turnover, stop_inflow_at_intervention, p, death_rate, percent_infected,
+                      percent_recovered, social_distance, social_distance_tau, initial_infected_list, rng=None,
+                      profiler=None, stop_condition=None):
+    """Runs the same simulation as simulation, yielding compartment counts at each integer time as it progresses.
+
+    No event history is kept, so memory does not grow with the length of the run, and the caller can plot results
+    or stop the run early (by breaking out of the loop) while it is going.
 
+    Args:
+        same as simulation, except time_grid
+
+    Yields:
+        dict for each time step with keys:
+            time: integer time at the end of the step
+            S, I, R, D: # of susceptible, infected, recovered and dead inmates at time, after adding and releasing
+                inmates
+            interventions: list of interventions enacted at time ('release', 'stop_inflow', 'social_distance')
+            delta_recovered: # of recovered inmates added minus # of recovered inmates released at time
+    """
+    print('Starting simulation...')
+    rng = np.random.default_rng() if rng is None else rng
+    profiler = NULL_PROFILER if profiler is None else profiler
+    with profiler.phase('initialize'):
+        store, engine = initialize_simulation(G, tau, gamma, rho, initial_infected_list, rng, record=False)
+    yield from simulation_steps(G, store, engine, max_time, number_infected_before_release, release_number,
+                                background_inmate_turnover, stop_inflow_at_intervention, p, death_rate,
+                                percent_infected, percent_recovered, social_distance, social_distance_tau, rng,
+                                profiler, stop_condition)
+    print('Simulation completed.\n')
+
+
+def initialize_simulation(G, tau, gamma, rho, initial_infected_list, rng, record):
+    """Sets initial infections and builds the compartment store and event-driven engine.
+
+    Returns:
+        store: CompartmentStore holding the state of every inmate in G
+        engine: EventDrivenSIR running on G
+    """
     # Check we are using initial_infected_list
     if initial_infected_list is not None:
         print('Using initial infected list to set initial infected.')
         infected_list = initial_infected_list.copy()
     else:  # Choose random initial infections based on rho
         print('Using rho to set initial infected.')
-        infected_list = list(np.random.choice(list(G.nodes), int(np.ceil(rho * len(G.nodes))), replace=False))
+        infected_list = list(rng.choice(list(G.nodes), int(np.ceil(rho * len(G.nodes))), replace=False))
+
+    # Track the compartment of every inmate
+    store = CompartmentStore(G.nodes)
+    for node in infected_list:
+        store.set_state(node, INFECTED)
+
+    # Single event-driven engine persists across all time steps
+    engine = EventDrivenSIR(G, tau, gamma, store, rng=rng, record=record)
+
+    return store, engine
+
+
+def simulation_steps(G, store, engine, max_time, number_infected_before_release, release_number,
+                     background_inmate_turnover, stop_inflow_at_intervention, p, death_rate, percent_infected,
+                     percent_recovered, social_distance, social_distance_tau, rng, profiler=NULL_PROFILER,
+                     stop_condition=None, start_time=0, previous_steps=(), until_trigger=False, fast_forward=True):
+    """Runs the simulation loop, yielding the state after each time step. See stream_simulation for what is yielded.
+
+    Once no inmate is infected and no infected inmate can be added, no infection can ever happen again. From then on
+    the remaining time steps only add and release inmates in the store, without updating G or drawing edges.
+
+    Args:
+        start_time: time step to start from, when resuming a run whose earlier steps are previous_steps
+        previous_steps: steps already run before start_time, with no interventions enacted yet
+        until_trigger: if True, stops right when the release condition is met, before enacting interventions (see
+            counterfactuals.Checkpoint)
+        fast_forward: should steps after infections die out skip updating G? Must be False if infected inmates can
+            be added from outside the loop, e.g. by transfers between facilities
+        other arguments: same as simulation
+
+    Returns:
+        time step the loop stopped at, which resumes the run when passed as start_time
+    """
+    release_occurred = False
+    background_release_number = background_inmate_turnover
+    cumulative_delta_recovered = sum(step['delta_recovered'] for step in previous_steps)
+    steps = list(previous_steps)
 
     # Loop over time
-    for i in range(max_time):
-        # Run 1 time unit of simulation
-        data = EoN.fast_SIR(G, tau, gamma, initial_infecteds=infected_list, initial_recovereds=recovered_list,
-                            tmin=i, tmax=i + 1, return_full_data=True)
-        data_list.append(data)
+    for i in range(start_time, max_time):
+        step_start = time.perf_counter()
+        extinct = fast_forward and store.count(INFECTED) == 0 and (background_inmate_turnover <= 0 or
+                                                                   percent_infected <= 0)
 
-        # Update infected and recovered inmate lists
-        infected_list, recovered_list = get_infected(data, i + 1), get_recovered(data, i + 1)
+        # Run 1 time unit of simulation. Once extinct, this only records the state, as all queued events are outdated
+        num_events = engine.num_events
+        with profiler.phase('run_events'):
+            engine.run_until(i + 1)
+        profiler.count('events_processed', engine.num_events - num_events)
 
         # Check if release condition has been met
-        if not release_occurred and len(infected_list) >= number_infected_before_release:
+        interventions = []
+        if not release_occurred and store.count(INFECTED) >= number_infected_before_release:
+            if until_trigger:
+                return i
             background_inmate_turnover, r_n, tau = enact_interventions(background_inmate_turnover,
                                                                        background_release_number, i + 1,
-                                                                       infected_list, release_number,
+                                                                       store.count(INFECTED), release_number,
                                                                        social_distance,
                                                                        social_distance_tau,
                                                                        stop_inflow_at_intervention,
-                                                                       tau)
+                                                                       engine.tau)
+            if tau != engine.tau:
+                with profiler.phase('set_tau'):
+                    engine.set_tau(tau)
+            interventions = [name for name, enacted in [('release', release_number),
+                                                        ('stop_inflow', stop_inflow_at_intervention),
+                                                        ('social_distance', social_distance)] if enacted]
             release_occurred = True
         else:  # If not, use background release rate
             r_n = background_release_number
 
         # Add and release inmates
-        G, infected_list, recovered_list, delta_recovered = recalibrate_graph(G, infected_list, recovered_list,
-                                                                              background_inmate_turnover, r_n, p,
-                                                                              percent_infected, percent_recovered,
-                                                                              death_rate)
-
-        # Track the number of recovered inmates added or released at each time step
-        delta_recovered_list.append(delta_recovered)
-
-    # Process raw data into t, S, I, R, D arrays
-    t, S, I, R, D = process_data(data_list, delta_recovered_list, death_rate)
-
-    print('Simulation completed.\n')
-    return t, S, I, R, D
+        if extinct:
+            with profiler.phase('fast_forward'):
+                delta_recovered = recalibrate_store(G, store, background_inmate_turnover, r_n, percent_infected,
+                                                    percent_recovered, death_rate, rng)
+            profiler.count('fast_forward_steps')
+        else:
+            with profiler.phase('recalibrate_graph'):
+                G, delta_recovered = recalibrate_graph(G, store, background_inmate_turnover, r_n, p,
+                                                       percent_infected, percent_recovered, death_rate, engine, rng,
+                                                       profiler)
+
+        # Deaths are a percent of recovered inmates, not counting recovered inmates added or released
+        cumulative_delta_recovered += delta_recovered
+        num_dead = np.ceil((store.count(RECOVERED) - cumulative_delta_recovered) * death_rate)
+        step = {'time': i + 1, 'S': store.count(SUSCEPTIBLE), 'I': store.count(INFECTED),
+                'R': store.count(RECOVERED) - num_dead, 'D': num_dead, 'interventions': interventions,
+                'delta_recovered': delta_recovered}
+        profiler.step(step, time.perf_counter() - step_start)
+        yield step
+
+        # Check user-defined stopping criteria
+        if stop_condition is not None:
+            steps.append(step)
+            if stop_condition(steps):
+                print(f'Stop condition met at time {i + 1}.')
+                return i + 1
+    return max_time
 
 
 # Helper Functions
-def enact_interventions(background_inmate_turnover, background_release_number, time, infected_list, release_number,
+def enact_interventions(background_inmate_turnover, background_release_number, time, num_infected, release_number,
                         social_distance, social_distance_tau, stop_inflow_at_intervention, tau):
     """Enacts specified interventions."""
     # Print intervention info
-    print(f'Release intervention condition met:\n\tTime: {time}\n\t# of infected: {len(infected_list)}')
+    print(f'Release intervention condition met:\n\tTime: {time}\n\t# of infected: {num_infected}')
 
     # Release intervention
     r_n = background_release_number
@@ -112,147 +243,233 @@ def enact_interventions(background_inmate_turnover, background_release_number, t
     return background_inmate_turnover, r_n, tau
 
 
-def recalibrate_graph(G, infected_list, recovered_list, birth_number, release_number, p,
-                      percent_infected, percent_recovered, death_rate):
+def recalibrate_graph(G, store, birth_number, release_number, p, percent_infected, percent_recovered, death_rate,
+                      engine=None, rng=None, profiler=NULL_PROFILER):
     """Updates graph by adding new inmates and removing released inmates.
 
     Args:
         G: a Networkx graph
-        infected_list: list of infected nodes
-        recovered_list: list of recovered nodes
+        store: CompartmentStore holding the state of every inmate in G
         birth_number: # of inmates added at each time step
         release_number: # of inmates to release
         p: probability of contact between inmate and other inmates
         percent_infected: percent of general population that is infected
         percent_recovered: percent of general population that is recovered
         death_rate: percent of recovered inmates that die
+        engine: EventDrivenSIR running on G, notified of added and released inmates
+        rng: numpy Generator used for random draws
+        profiler: instrumentation.Profiler timing releases and additions
 
     Returns:
         G: Networkx graph with new inmates added and released inmates removed
-        infected_list: infected_list with released inmates removed
-        recovered_list: recovered_list with released inmates removed
+        delta_recovered: # of recovered inmates added minus # of recovered inmates released
     """
     # Release inmates
-    G, infected_list, recovered_list, num_recovered_released = remove_nodes(G, infected_list, recovered_list,
-                                                                            release_number, death_rate)
+    with profiler.phase('remove_nodes'):
+        G, num_recovered_released = remove_nodes(G, store, release_number, death_rate, engine, rng)
+    profiler.count('nodes_removed', max(release_number, 0))
 
     # Add new inmates
-    G, num_recovered_added = add_nodes(G, infected_list, recovered_list, birth_number, p, percent_infected,
-                                       percent_recovered)
+    with profiler.phase('add_nodes'):
+        G, num_recovered_added = add_nodes(G, store, birth_number, p, percent_infected, percent_recovered, engine, rng,
+                                           profiler)
+    profiler.count('nodes_added', max(birth_number, 0))
 
     # Track how many recovered inmates were added and released
     delta_recovered = num_recovered_added - num_recovered_released
 
-    return G, infected_list, recovered_list, delta_recovered
+    return G, delta_recovered
 
 
-def process_data(data_list, delta_recovered_list, death_rate: float):
+def process_data(data_list, delta_recovered_list, death_rate: float, time_grid=None, stop_time=None):
     """Processes raw simulation loop data list into plottable times, S, I, and R arrays.
 
     Args:
-        data_list: list of Simulation_Investigation objects as output by simulation
+        data_list: list of objects with a summary() method returning times and a dict of S, I, R counts, e.g.
+            EoN Simulation_Investigation objects or an EventDrivenSIR engine
         delta_recovered_list: list of change in recovered inmates at each time step due to additions/releases
         death_rate: percent of recovered inmates that die
+        time_grid: If time_grid passed, results are resampled onto it. Otherwise, results are given at event times
+        stop_time: time the run stopped at, if it stopped early. Results at grid times after it are NaN rather than
+            the last recorded values
 
     Returns:
-        t: array of times at which events occur
+        t: array of times at which events occur, or time_grid
         S: # of susceptible inmates at each time step
         I: # of infected inmates at each time step
         R: # of recovered inmates at each time step
         D: # of dead inmates at each time step
     """
-    # Get t, S, I, R data from first time step
-    first_time, first_dict_of_states = data_list[0].summary()
-    times_ll = [first_time]
-    susceptible_ll = [first_dict_of_states['S']]
-    infected_ll = [first_dict_of_states['I']]
-    recovered_ll = [first_dict_of_states['R']]
-
-    # For next time steps, get data, but delete first element of each time step to fix "recovered bug"
-    for data in data_list[1:]:
-        times, dict_of_states = data.summary()
-
-        # Append each time's data to appropriate list
-        times_ll.append(np.delete(times, 0))
-        susceptible_ll.append(np.delete(dict_of_states['S'], 0))  # Deletes first element because of "recovered bug"
-        infected_ll.append(np.delete(dict_of_states['I'], 0))
-        recovered_ll.append(np.delete(dict_of_states['R'], 0))
-
-    # Aggregate quantities into single lists
-    t, S, I, R = np.concatenate(times_ll), np.concatenate(susceptible_ll), \
-                 np.concatenate(infected_ll), np.concatenate(recovered_ll)
+    summaries = [data.summary() for data in data_list]
+
+    # For time steps after the first, delete first element of each time step to fix "recovered bug"
+    t = np.concatenate([times[int(step > 0):] for step, (times, _) in enumerate(summaries)])
+    S, I, R = [np.concatenate([dict_of_states[state][int(step > 0):]
+                               for step, (_, dict_of_states) in enumerate(summaries)]) for state in 'SIR']
 
     # Calculate deaths
     R, D = calculate_deaths(t, R, delta_recovered_list, death_rate)
 
+    # Align results on fixed times
+    if time_grid is not None:
+        S, I, R, D = resample_to_grid(t, time_grid, S, I, R, D)
+        t = np.asarray(time_grid)
+        if stop_time is not None:
+            S, I, R, D = [np.where(t > stop_time, np.nan, values) for values in (S, I, R, D)]
+
     return t, S, I, R, D
 
 
-def remove_nodes(G, infected_list, recovered_list, release_number, death_rate):
+def remove_nodes(G, store, release_number, death_rate, engine=None, rng=None):
     """Removes release_number inmates from G, selecting inmates of state proportional to the percentage of their
-    state in the prison."""
-    num_recovered_released = 0
+    state in the prison.
 
-    # Get list of susceptible inmates
-    susceptible_list = list(np.setdiff1d(G.nodes, np.union1d(infected_list, recovered_list)))
-
-    for i in range(release_number):
-        # Calculate proportion of inmates that are susceptible, infected, or recovered (not dead)
-        num_of_recovered_not_dead = np.floor(len(recovered_list) * (1 - death_rate))
-        dm = len(susceptible_list) + len(infected_list) + num_of_recovered_not_dead
-
-        # Prevent division by 0
-        if dm == 0:
-            raise Exception(
-                'All inmates died or got released from prison :( Try turning down max_time or background '
-                'turnover rate')
-
-        # Proportion of state = # of inmates of state / # of alive inmates
-        ps = len(susceptible_list) / dm
-        pi = len(infected_list) / dm
-        pr = num_of_recovered_not_dead / dm
-
-        # Select state of inmate to remove according to their percentage of prison population
-        state = np.random.choice(['S', 'I', 'R'], p=[ps, pi, pr])
-        if state == 'S':
-            removed_inmate = susceptible_list.pop()  # We assume lists of inmates are ordered randomly
-        elif state == 'I':
-            removed_inmate = infected_list.pop()
-        else:
-            removed_inmate = recovered_list.pop()
-            num_recovered_released += 1
-        G.remove_node(removed_inmate)
+    The number of susceptible, infected and recovered (not dead) inmates released is drawn in one multivariate
+    hypergeometric draw, which matches releasing inmates one at a time without replacement. The released inmates of
+    each state are then chosen uniformly at random.
+    """
+    if release_number <= 0:
+        return G, 0
+    rng = np.random.default_rng() if rng is None else rng
 
-    return G, infected_list, recovered_list, num_recovered_released
+    released_inmates, num_released = release_from_store(store, release_number, death_rate, rng)
+    G.remove_nodes_from(released_inmates)
+    if engine is not None:
+        engine.release(released_inmates)
+
+    return G, int(num_released[RECOVERED])
+
+
+def add_nodes(G, store, birth_number, p, percent_infected, percent_recovered, engine=None, rng=None,
+              profiler=NULL_PROFILER):
+    """Adds birth_number inmates to G, with probability p of an edge forming between new node and each existing node.
+
+    The whole intake is drawn at once: the states of the new inmates come from one multinomial draw, and their edges
+    from one binomial draw of the edge count followed by sampling which of the possible pairs get an edge. If G is a
+    networks.PrisonNetwork, new inmates are instead housed in free beds and connected by the network (p is unused).
+    """
+    if birth_number <= 0:
+        return G, 0
+    rng = np.random.default_rng() if rng is None else rng
 
+    new_inmates = next_inmate_ids(G, birth_number)
+    num_edges = connect_new_inmates(G, store, new_inmates, p, rng)
+    profiler.count('edges_created', num_edges)
+
+    # Set states of new inmates. Edges are drawn independently of states, so states can be assigned in ID order
+    num_recovered_added = admit_to_store(store, new_inmates, percent_infected, percent_recovered, rng)
+
+    # Schedule infection events for the new inmates once all their edges exist
+    if engine is not None:
+        engine.admit(new_inmates)
+
+    return G, int(num_recovered_added)
+
+
+def connect_new_inmates(G, store, new_inmates, p, rng):
+    """Adds new inmates to G, with probability p of an edge between each new inmate and each other inmate.
+
+    If G is a networks.PrisonNetwork, new inmates are instead housed in free beds and connected by the network.
+
+    Returns:
+        # of edges created
+    """
+    if isinstance(G, PrisonNetwork):  # Structured networks house new inmates in cells and draw their contacts
+        sources, targets = G.house(new_inmates, rng)
+    else:
+        # Connect new inmates to existing inmates (G(n,p) model edge generation for new nodes)
+        new_ids = np.array(new_inmates)
+        num_existing = len(store)
+        num_pairs = len(new_inmates) * num_existing
+        pair_idx = rng.choice(num_pairs, size=rng.binomial(num_pairs, p), replace=False)
+        sources = new_ids[pair_idx // max(num_existing, 1)]
+        targets = store.nodes_at(pair_idx % max(num_existing, 1))
+
+        # Connect new inmates to each other, without self-edges
+        first, second = np.triu_indices(len(new_inmates), k=1)
+        connected = rng.random(len(first)) < p
+        sources = np.concatenate([sources, new_ids[first[connected]]])
+        targets = np.concatenate([targets, new_ids[second[connected]]])
+        G.add_nodes_from(new_inmates)
+
+    G.add_edges_from(zip(sources.tolist(), targets.tolist()))
+    return len(sources)
+
+
+def recalibrate_store(G, store, birth_number, release_number, percent_infected, percent_recovered, death_rate,
+                      rng=None):
+    """Adds new inmates to and releases inmates from the store only, leaving the edges of G untouched.
+
+    Used once no infection can happen anymore, when contacts between inmates no longer matter. Inmates are drawn
+    exactly as in recalibrate_graph, and new inmates still get IDs from the counter on G.
 
-def add_nodes(G, infected_list, recovered_list, birth_number, p, percent_infected, percent_recovered):
-    """Adds birth_number inmates to G, with probability p of an edge forming between new node and each existing node."""
+    Returns:
+        delta_recovered: # of recovered inmates added minus # of recovered inmates released
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    num_recovered_released = 0
+    if release_number > 0:
+        _, num_released = release_from_store(store, release_number, death_rate, rng)
+        num_recovered_released = int(num_released[RECOVERED])
     num_recovered_added = 0
+    if birth_number > 0:
+        num_recovered_added = admit_to_store(store, next_inmate_ids(G, birth_number), percent_infected,
+                                             percent_recovered, rng)
+    return num_recovered_added - num_recovered_released
+
+
+def release_from_store(store, release_number, death_rate, rng):
+    """Chooses release_number inmates to release and removes them from the store.
 
-    # Add birth_number new inmates
-    for i in range(birth_number):
-        inmate_id = list(G.nodes)[-1] + 1  # Make sure node ID doesn't already exist
-        G.add_node(inmate_id)
+    Returns:
+        released_inmates: list of released node IDs
+        num_released: array of # of susceptible, infected and recovered inmates released
+    """
+    # Count inmates that are susceptible, infected, or recovered (not dead)
+    num_of_recovered_not_dead = int(np.floor(store.count(RECOVERED) * (1 - death_rate)))
+    num_alive = store.count(SUSCEPTIBLE) + store.count(INFECTED) + num_of_recovered_not_dead
+
+    # Prevent releasing more inmates than are alive in prison
+    if release_number > num_alive:
+        raise Exception(
+            'All inmates died or got released from prison :( Try turning down max_time or background '
+            'turnover rate')
 
-        # Set state of new inmate
-        percent_susceptible = 1 - percent_infected - percent_recovered
-        state = np.random.choice(['S', 'I', 'R'], p=[percent_susceptible, percent_infected, percent_recovered])
-        if state == 'I':
-            infected_list.append(inmate_id)
-        elif state == 'R':
-            recovered_list.append(inmate_id)
-            num_recovered_added += 1
+    # Select # of inmates of each state to release according to their percentage of prison population
+    num_released = rng.multivariate_hypergeometric(
+        [store.count(SUSCEPTIBLE), store.count(INFECTED), num_of_recovered_not_dead], release_number)
 
-        # Connect inmate to existing inmates
-        for other_inmate_id in G.nodes:
-            # Do not allow self-edges
-            if inmate_id == other_inmate_id:
-                continue
-            if np.random.rand() < p:  # add edge with certain probability (G(n,p) model edge generation for new node)
-                G.add_edge(inmate_id, other_inmate_id)
+    # Choose which inmates of each state are released
+    released_inmates = np.concatenate([store.sample(state, number, rng)
+                                       for state, number in zip((SUSCEPTIBLE, INFECTED, RECOVERED), num_released)])
+    released_inmates = released_inmates.tolist()
+    store.remove(released_inmates)
 
-    return G, num_recovered_added
+    return released_inmates, num_released
+
+
+def admit_to_store(store, new_inmates, percent_infected, percent_recovered, rng):
+    """Draws the states of new inmates from the general population and adds them to the store, in ID order.
+
+    Returns:
+        num_recovered_added: # of recovered inmates added
+    """
+    percent_susceptible = 1 - percent_infected - percent_recovered
+    num_susceptible, num_infected, num_recovered_added = rng.multinomial(
+        len(new_inmates), [percent_susceptible, percent_infected, percent_recovered])
+    store.add(new_inmates[:num_susceptible], SUSCEPTIBLE)
+    store.add(new_inmates[num_susceptible:num_susceptible + num_infected], INFECTED)
+    store.add(new_inmates[num_susceptible + num_infected:], RECOVERED)
+    return int(num_recovered_added)
+
+
+def next_inmate_ids(G, count):
+    """Returns count unused node IDs for new inmates, from a counter stored on G that only ever increases."""
+    if 'next_inmate_id' not in G.graph:
+        G.graph['next_inmate_id'] = max(G.nodes, default=-1) + 1
+    first_id = G.graph['next_inmate_id']
+    G.graph['next_inmate_id'] += count
+    return list(range(first_id, first_id + count))
 
 
 def calculate_deaths(t, recovered_inmates_and_dead_inmates, delta_recovered_list, death_rate):
@@ -261,16 +478,17 @@ def calculate_deaths(t, recovered_inmates_and_dead_inmates, delta_recovered_list
     #   1) Inmates that we know are recovered
     #   2) Inmates that may be recovered or dead
 
-    recovered_or_dead_inmates = recovered_inmates_and_dead_inmates.copy()
     # All added/released "recovered" inmates are not dead
-    for i in range(1, len(delta_recovered_list)):
-        # Check if any inmates changed state at the added/release time
-        if np.where(t == i)[0].size != 0:
-            # Find time index where additions/releases occurred
-            time_idx = np.where(t == i)[0][0]
+    # Find time index where additions/releases occurred at each integer time i, if any inmates changed state then
+    addition_times = np.arange(1, len(delta_recovered_list))
+    time_idx = np.searchsorted(t, addition_times)
+    occurred = time_idx < len(t)
+    occurred[occurred] = t[time_idx[occurred]] == addition_times[occurred]
 
-            # Adjust for added/released # recovered inmates
-            recovered_or_dead_inmates[time_idx:] -= delta_recovered_list[i - 1]
+    # Adjust for added/released # recovered inmates from each addition time on
+    adjustments = np.zeros(len(t) + 1, dtype=np.asarray(recovered_inmates_and_dead_inmates).dtype)
+    np.add.at(adjustments, time_idx[occurred], np.asarray(delta_recovered_list[:-1])[occurred])
+    recovered_or_dead_inmates = recovered_inmates_and_dead_inmates - np.cumsum(adjustments[:-1])
 
     # Now we have the inmates that may be recovered or dead
     # Calculate the amount of these inmates that are dead
@@ -282,16 +500,15 @@ def calculate_deaths(t, recovered_inmates_and_dead_inmates, delta_recovered_list
     return R, D
 
 
-def get_infected(data: EoN.Simulation_Investigation, end_time: int):
-    """Returns list of infected nodes."""
-    return get_type_of_nodes(data, end_time, 'I')
+def resample_to_grid(t, time_grid, *arrays):
+    """Resamples step functions recorded at event times t onto time_grid.
 
+    The value at each grid time is the value after the last event at or before it, so runs with different event times
+    can be aligned and stacked.
 
-def get_recovered(data: EoN.Simulation_Investigation, end_time: int):
-    """Returns list of recovered nodes."""
-    return get_type_of_nodes(data, end_time, 'R')
-
-
-def get_type_of_nodes(data: EoN.Simulation_Investigation, end_time: int, state: str):
-    """Returns list of certain type of nodes."""
-    return [node for (node, s) in data.get_statuses(time=end_time).items() if s == state]
+    Returns:
+        list of arrays, one per array in arrays, each of length len(time_grid)
+    """
+    idx = np.searchsorted(t, time_grid, side='right') - 1
+    idx = np.clip(idx, 0, len(t) - 1)
+    return [np.asarray(array)[idx] for array in arrays]
@@ -0,0 +1,36 @@
+class InfectedBelow:
+    """Stop condition met once the # of infected inmates has stayed below threshold for days consecutive time steps.
+
+    Stop conditions are passed as stop_condition to simulation, stream_simulation or end_to_end, and are called after
+    every time step with the list of steps so far (the dicts yielded by stream_simulation). They keep no state of their
+    own, so one condition can be reused across runs and sent to worker processes.
+
+    Args:
+        threshold: # of infected inmates below which the outbreak is considered over
+        days: # of consecutive time steps I must stay below threshold
+    """
+
+    def __init__(self, threshold, days):
+        self.threshold = threshold
+        self.days = days
+
+    def __call__(self, steps):
+        recent = steps[-self.days:]
+        return len(recent) == self.days and all(step['I'] < self.threshold for step in recent)
+
+
+class PeakPassed:
+    """Stop condition met once the # of infected inmates has fallen below fraction of its highest value so far.
+
+    Args:
+        fraction: fraction of the peak # of infected inmates below which the peak is considered passed
+        min_peak: smallest peak that counts, so that the run does not stop on noise before the outbreak takes off
+    """
+
+    def __init__(self, fraction=0.5, min_peak=0):
+        self.fraction = fraction
+        self.min_peak = min_peak
+
+    def __call__(self, steps):
+        peak = max(step['I'] for step in steps)
+        return peak >= self.min_peak and steps[-1]['I'] < self.fraction * peak
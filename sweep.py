@@ -0,0 +1,139 @@
+import contextlib
+import hashlib
+import inspect
+import io
+import itertools
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+from end_to_end import end_to_end
+from stopping import InfectedBelow, PeakPassed
+
+# end_to_end parameters that do not change simulation results, so they are left out of cache keys
+NON_RESULT_PARAMETERS = ('custom_graph', 'seed', 'save_plot', 'title', 'summarize', 'profiler')
+
+# Graph every run starts from, set once per worker process by init_worker
+_base_graph = None
+
+
+def run_sweep(grid, seeds=(0,), cache_dir='sweep_cache', processes=None, custom_graph=None, store=None, **kwargs):
+    """Runs end_to_end on every combination of grid values, computing only the runs missing from an on-disk cache.
+
+    Each run is stored in its own file in cache_dir as soon as it finishes, named by a hash of its full parameters
+    (including end_to_end defaults), its seed and a fingerprint of custom_graph. Re-running a sweep, or resuming one
+    that was interrupted, only computes the runs that have no file yet.
+
+    Args:
+        grid: dict mapping end_to_end parameter names to lists of values to sweep over
+        seeds: ints or numpy SeedSequences to run every combination with. The same seeds are used for every
+            combination, so runs with the same seed share random numbers and can be compared in pairs
+        cache_dir: directory storing finished runs
+        processes: # of worker processes. If not passed, uses # of CPUs. If 1, runs in this process
+        custom_graph: If custom_graph passed, all runs start from it. Otherwise, each run builds a graph from N, p and
+            its seed
+        store: result_store.ResultStore that runs not already in it are appended to, keyed by their cache key, to
+            query and aggregate them later
+        **kwargs: end_to_end parameters shared by all runs
+
+    Returns:
+        list of dicts, one per run in grid order, with the run's 'parameters', 'seed', and 't', 'S', 'I', 'R', 'D'
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    fingerprint = graph_fingerprint(custom_graph) if custom_graph is not None else None
+
+    # List every run in the sweep
+    runs = []
+    for values in itertools.product(*grid.values()):
+        parameters = bind_parameters(dict(kwargs, **dict(zip(grid, values))))
+        for seed in seeds:
+            path = os.path.join(cache_dir, f'{cache_key(parameters, seed, fingerprint)}.npz')
+            runs.append((path, parameters, seed))
+
+    # Run only the runs not already cached
+    missing = [run for run in runs if not os.path.exists(run[0])]
+    print(f'{len(runs) - len(missing)} of {len(runs)} runs cached. Running {len(missing)} runs...')
+    if processes == 1:
+        init_worker(custom_graph)
+        for run in missing:
+            run_and_cache(run)
+    elif missing:
+        with multiprocessing.Pool(processes, initializer=init_worker, initargs=(custom_graph,)) as pool:
+            for _ in pool.imap_unordered(run_and_cache, missing):
+                pass
+    print('Sweep completed.')
+
+    results = [load_run(path) for path, _, _ in runs]
+    if store is not None:
+        keys = [os.path.splitext(os.path.basename(path))[0] for path, _, _ in runs]
+        stored_keys = store.keys
+        new_runs = [dict(result, key=key) for result, key in zip(results, keys) if key not in stored_keys]
+        store.append(new_runs)
+        print(f'Stored {len(new_runs)} new runs.')
+
+    return results
+
+
+def bind_parameters(parameters):
+    """Returns all end_to_end parameters a call with parameters would use, except NON_RESULT_PARAMETERS."""
+    bound = inspect.signature(end_to_end).bind(**parameters)
+    bound.apply_defaults()
+    return {name: value for name, value in bound.arguments.items() if name not in NON_RESULT_PARAMETERS}
+
+
+def cache_key(parameters, seed, fingerprint):
+    """Returns a hash identifying the results of a run."""
+    content = json.dumps({'parameters': parameters, 'seed': seed, 'graph': fingerprint}, sort_keys=True,
+                         default=to_json)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def graph_fingerprint(G):
+    """Returns a hash of the nodes and edges of G."""
+    nodes = np.sort(np.fromiter(G.nodes, dtype=np.int64, count=G.number_of_nodes()))
+    edges = np.sort(np.array(list(G.edges), dtype=np.int64).reshape(-1, 2), axis=1)
+    edges = edges[np.lexsort((edges[:, 1], edges[:, 0]))]
+    return hashlib.sha256(nodes.tobytes() + edges.tobytes()).hexdigest()
+
+
+def load_run(path):
+    """Loads a cached run."""
+    with np.load(path) as data:
+        run = {name: data[name] for name in ('t', 'S', 'I', 'R', 'D')}
+        run.update(json.loads(str(data['metadata'])))
+    return run
+
+
+# Helper functions
+def init_worker(G):
+    """Stores the base graph in the worker process."""
+    global _base_graph
+    _base_graph = G
+
+
+def run_and_cache(run):
+    """Runs one run of the sweep and writes it to its cache file."""
+    path, parameters, seed = run
+    with contextlib.redirect_stdout(io.StringIO()):  # Silence per-run progress output
+        t, S, I, R, D = end_to_end(custom_graph=_base_graph, seed=seed, summarize=False, **parameters)
+
+    # Write to a temporary file first so an interrupted write never leaves a corrupt cache entry
+    metadata = json.dumps({'parameters': parameters, 'seed': seed}, default=to_json)
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'wb') as f:
+        np.savez(f, t=t, S=S, I=I, R=R, D=D, metadata=metadata)
+    os.replace(temporary_path, path)
+
+
+def to_json(value):
+    """Converts numpy values, seed sequences and stop conditions to JSON-serializable values."""
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    if isinstance(value, np.random.SeedSequence):  # Its random numbers only depend on these
+        return {'SeedSequence': {'entropy': np.asarray(value.entropy).tolist(), 'spawn_key': list(value.spawn_key),
+                                 'pool_size': value.pool_size}}
+    if isinstance(value, (InfectedBelow, PeakPassed)):
+        return {type(value).__name__: vars(value)}
+    raise TypeError(f'Cannot serialize {type(value).__name__} in sweep parameters')
@@ -1,4 +1,23 @@
+import contextlib
+import io
+import os
+import tempfile
+
+import networkx as nx
+import numpy as np
+
+from analysis import count_total_infected, find_infections_peak
+from batch_analysis import render_figures, summarize_runs
+from batched import run_batched
+from compartments import INFECTED, RECOVERED, SUSCEPTIBLE, CompartmentStore
+from counterfactuals import run_counterfactuals
 from end_to_end import end_to_end
+from ensemble import aggregate_runs, run_ensemble
+from metapopulation import run_metapopulation
+from networks import csr_from_networkx
+from result_store import ResultStore
+from simulation import resample_to_grid, simulation, stream_simulation
+from stopping import InfectedBelow, PeakPassed
 
 
 def main():
@@ -13,6 +32,19 @@ def main():
 
     print('Commencing tests ...')
     test_death_rate_is_strictly_increasing(D)
+    test_compartment_store_tracks_states()
+    test_seeded_ensemble_is_reproducible()
+    test_stream_matches_simulation()
+    test_run_stops_once_infections_die_out()
+    test_stopped_run_is_nan_after_stopping()
+    test_mean_field_conserves_inmates()
+    test_branches_match_end_to_end()
+    test_csr_graph_matches_networkx()
+    test_transfers_move_inmates_between_facilities()
+    test_batched_replicates_conserve_inmates()
+    test_batched_mean_matches_ensemble()
+    test_result_store_reloads_runs()
+    test_batch_statistics_match_single_runs()
     print('Testing completed.')
 
     print('Program ending.')
@@ -27,5 +59,219 @@ def test_death_rate_is_strictly_increasing(D):
     print('Passed')
 
 
+def test_compartment_store_tracks_states():
+    print('test_compartment_store_tracks_states:', end=' ')
+    store = CompartmentStore(range(10))
+    store.set_state(3, INFECTED)
+    store.set_state(5, INFECTED)
+    store.set_state(3, RECOVERED)
+    store.remove([0, 5])
+    store.add([10, 11], INFECTED)  # Reuses the slots of released inmates 0 and 5
+
+    expected = {SUSCEPTIBLE: {1, 2, 4, 6, 7, 8, 9}, INFECTED: {10, 11}, RECOVERED: {3}}
+    for state, nodes in expected.items():
+        if set(store.members(state).tolist()) != nodes or store.count(state) != len(nodes):
+            print('Failed')
+            return
+    if len(store.status) != 16 or set(store.nodes_at(np.arange(len(store))).tolist()) != set.union(*expected.values()):
+        print('Failed')
+        return
+    print('Passed')
+
+
+def test_seeded_ensemble_is_reproducible():
+    print('test_seeded_ensemble_is_reproducible:', end=' ')
+    first = run_ensemble(4, 50, 20, False, seed=1, processes=1, N=300, p=0.05, max_time=20)
+    second = run_ensemble(4, 50, 20, False, seed=1, processes=2, N=300, p=0.05, max_time=20)
+    for compartment in ('S', 'I', 'R', 'D'):
+        if not np.array_equal(first[1][compartment], second[1][compartment]):
+            print('Failed')
+            return
+    print('Passed')
+
+
+def test_stream_matches_simulation():
+    print('test_stream_matches_simulation:', end=' ')
+    G = nx.fast_gnp_random_graph(500, 0.03, seed=0)
+    args = (0.03, 0.07, 0.01, 30, 40, 100, 10, False, 0.03, 0.012, 0.0035, 0.0015, True, 0.01, None)
+    with contextlib.redirect_stdout(io.StringIO()):
+        t, S, I, R, D = simulation(G.copy(), *args, rng=np.random.default_rng(0))
+        steps = list(stream_simulation(G.copy(), *args, rng=np.random.default_rng(0)))
+
+    # simulation does not record the turnover at the final time, so compare up to the time before
+    time_grid = np.arange(1, 30)
+    expected = resample_to_grid(t, time_grid, S, I, R, D)
+    for compartment, values in zip('SIRD', expected):
+        if not np.array_equal(values, [step[compartment] for step in steps[:-1]]):
+            print('Failed')
+            return
+    print('Passed')
+
+
+def test_run_stops_once_infections_die_out():
+    print('test_run_stops_once_infections_die_out:', end=' ')
+    G = nx.fast_gnp_random_graph(500, 0.01, seed=0)
+    args = (0.001, 0.2, 0.01, 200, 1000, 0, 10, False, 0.01, 0.012, 0.0, 0.0015, False, 0.01, None)
+    with contextlib.redirect_stdout(io.StringIO()):
+        steps = list(stream_simulation(G, *args, rng=np.random.default_rng(0), stop_condition=InfectedBelow(1, 5)))
+    # Inflow and release balance, so the population stays the same while fast-forwarding
+    last = steps[-1]
+    if len(steps) >= 200 or any(step['I'] for step in steps[-5:]) or last['S'] + last['R'] + last['D'] != 500:
+        print('Failed')
+        return
+    print('Passed')
+
+
+def test_stopped_run_is_nan_after_stopping():
+    print('test_stopped_run_is_nan_after_stopping:', end=' ')
+    parameters = dict(seed=3, N=1000, p=0.03, rho=0.01, max_time=30, time_grid=np.arange(31), summarize=False)
+    with contextlib.redirect_stdout(io.StringIO()):
+        stopped = np.stack(end_to_end(0, 10**6, False, stop_condition=PeakPassed(0.8, 50), **parameters)[1:])
+        full = np.stack(end_to_end(0, 10**6, False, **parameters)[1:])
+    # Results match the full run before the time the run stopped at (whose inmates are not yet added or released, as
+    # at max_time), and the mean across both runs is the full run's after it
+    stop_time = np.argmax(np.isnan(stopped[1])) - 1
+    _, mean, _ = aggregate_runs(np.stack([stopped, full]), (0.05, 0.95))
+    if stop_time <= 0 or not np.array_equal(stopped[:, :stop_time], full[:, :stop_time]) or \
+            not np.isnan(stopped[:, stop_time + 1:]).all() or \
+            not np.allclose(mean['I'][stop_time + 1:], full[1, stop_time + 1:]):
+        print('Failed')
+        return
+    print('Passed')
+
+
+def test_mean_field_conserves_inmates():
+    print('test_mean_field_conserves_inmates:', end=' ')
+    for method in ('mean_field', 'pairwise'):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t, S, I, R, D = end_to_end(500, 200, False, summarize=False, method=method)
+        # Inflow and release balance, and 500 inmates are released at the first integer time at which I >= 200
+        released = 500 * (t >= np.ceil(t[np.argmax(I >= 200)]))
+        if not np.allclose(S + I + R + D + released, 3000) or I.max() < 200:
+            print('Failed')
+            return
+    print('Passed')
+
+
+def test_branches_match_end_to_end():
+    print('test_branches_match_end_to_end:', end=' ')
+    branches = [dict(release_number=100, stop_inflow_at_intervention=True), dict(social_distance=True)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = run_counterfactuals(branches, 30, seed=2, N=500, p=0.03, max_time=30)
+        expected = [end_to_end(100, 30, True, seed=2, N=500, p=0.03, max_time=30, summarize=False),
+                    end_to_end(0, 30, False, seed=2, N=500, p=0.03, max_time=30, summarize=False, social_distance=True)]
+    for result, expected_result in zip(results, expected):
+        if not all(np.array_equal(values, expected_values) for values, expected_values in zip(result, expected_result)):
+            print('Failed')
+            return
+    print('Passed')
+
+
+def test_csr_graph_matches_networkx():
+    print('test_csr_graph_matches_networkx:', end=' ')
+    G = nx.fast_gnp_random_graph(300, 0.05, seed=0)
+    csr_graph = csr_from_networkx(G)
+    rng = np.random.default_rng(0)
+    for step in range(50):  # Enough changes to trigger compactions
+        released = rng.choice(list(G.nodes), 5, replace=False).tolist()
+        for graph in (G, csr_graph):
+            graph.remove_nodes_from(released)
+        new_inmates = list(range(300 + 5 * step, 305 + 5 * step))
+        edges = [(u, v) for u in new_inmates for v in rng.choice(list(G.nodes), 8, replace=False).tolist()]
+        for graph in (G, csr_graph):
+            graph.add_nodes_from(new_inmates)
+            graph.add_edges_from(edges)
+    if set(csr_graph.nodes) != set(G.nodes) or csr_graph.number_of_edges() != G.number_of_edges() or \
+            any(sorted(csr_graph.neighbors(node)) != sorted(G.neighbors(node)) for node in G):
+        print('Failed')
+        return
+    print('Passed')
+
+
+def test_transfers_move_inmates_between_facilities():
+    print('test_transfers_move_inmates_between_facilities:', end=' ')
+    facilities = [dict(N=300, p=0.05, rho=0.02), dict(N=300, p=0.05, rho=0, percent_infected=0)]
+    transfers = [[0, 6], [2, 0]]
+    with contextlib.redirect_stdout(io.StringIO()):
+        t, local, _ = run_metapopulation(facilities, transfers, max_time=20, seed=0, parallel=False)
+        t, parallel, _ = run_metapopulation(facilities, transfers, max_time=20, seed=0, parallel=True)
+    # The second facility only gets infections through transfers, and gains 4 inmates at each time step
+    populations = [sum(results[compartment] for compartment in 'SIRD') for results in local]
+    same = all(np.array_equal(first[compartment], second[compartment])
+               for first, second in zip(local, parallel) for compartment in 'SIRD')
+    if not same or local[1]['I'].max() == 0 or not np.array_equal(populations[1], 300 + 4 * np.minimum(t, 19)):
+        print('Failed')
+        return
+    print('Passed')
+
+
+def test_batched_replicates_conserve_inmates():
+    print('test_batched_replicates_conserve_inmates:', end=' ')
+    with contextlib.redirect_stdout(io.StringIO()):
+        t, runs, _, _ = run_batched(50, 100, 30, False, seed=0, N=500, p=0.03, max_time=30)
+        _, same_runs, _, _ = run_batched(50, 100, 30, False, seed=0, N=500, p=0.03, max_time=30)
+    # Inflow and release balance, and each replicate releases 100 inmates once, when it meets the release condition
+    populations = sum(runs[compartment] for compartment in 'SIRD')
+    same = all(np.array_equal(runs[compartment], same_runs[compartment]) for compartment in 'SIRD')
+    if (not same or not np.all(np.isin(populations, (400, 500))) or np.any(np.diff(populations) > 0)
+            or not np.any(populations[:, -1] == 400)):
+        print('Failed')
+        return
+    print('Passed')
+
+
+def test_batched_mean_matches_ensemble():
+    print('test_batched_mean_matches_ensemble:', end=' ')
+    parameters = dict(N=300, p=0.05, rho=0.03, tau=0.1, max_time=6, background_inmate_turnover=5, seed=2)
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, _, mean, _ = run_ensemble(150, 0, 10**6, False, processes=1, **parameters)
+        _, _, batched_mean, _ = run_batched(400, 0, 10**6, False, **parameters)
+    # The outbreak spreads fast, so time slices of a quarter of a time step would be off by about 25 inmates
+    if any(np.abs(batched_mean[compartment] - mean[compartment]).max() > 10 for compartment in 'SIR'):
+        print('Failed')
+        return
+    print('Passed')
+
+
+def test_result_store_reloads_runs():
+    print('test_result_store_reloads_runs:', end=' ')
+    with contextlib.redirect_stdout(io.StringIO()):
+        runs = []
+        for release_number in (0, 50):
+            for seed in (0, 1):
+                t, S, I, R, D = end_to_end(release_number, 30, False, seed=seed, N=300, max_time=20, summarize=False)
+                runs.append(dict(t=t, S=S, I=I, R=R, D=D, parameters={'release_number': release_number}, seed=seed))
+    with tempfile.TemporaryDirectory() as directory:
+        ResultStore(directory).append(runs[:2])
+        ResultStore(directory).append(runs[2:])
+        store = ResultStore(directory)
+        selected = [store.run(run_id) for run_id in store.select(release_number=50)]
+        same = len(selected) == 2 and all(np.array_equal(run['I'], expected_run['I'])
+                                          for run, expected_run in zip(selected, runs[2:]))
+        t, stacked = store.stack(time_grid=np.arange(21))
+    expected = np.stack([resample_to_grid(run['t'], t, run['I'])[0] for run in runs])
+    if not same or not np.array_equal(stacked['I'], expected):
+        print('Failed')
+        return
+    print('Passed')
+
+
+def test_batch_statistics_match_single_runs():
+    print('test_batch_statistics_match_single_runs:', end=' ')
+    with contextlib.redirect_stdout(io.StringIO()):
+        t, runs, _, _ = run_batched(20, 0, np.inf, False, seed=0, N=300, p=0.03, max_time=30)
+        statistics = summarize_runs(t, runs)
+        with tempfile.TemporaryDirectory() as directory:
+            paths = render_figures([('one run', t, {compartment: runs[compartment][0] for compartment in 'SIRD'}),
+                                    ('all runs', t, runs)], directory, processes=1)
+            rendered = all(os.path.getsize(path) > 0 for path in paths)
+    expected = [(count_total_infected(I), *find_infections_peak(t, I)) for I in runs['I']]
+    if not rendered or not np.array_equal(np.column_stack([statistics['total_infected'], statistics['peak_time'],
+                                                           statistics['peak_infected']]), expected):
+        print('Failed')
+        return
+    print('Passed')
+
+
 if __name__ == "__main__":
     main()